@@ -6,8 +6,13 @@ Can also be imported and used as a module. Refer:
 
 - class Cache           - Manage, query, and use a cache
 - class CacheDB         - Manage and query a cache db
+- func download_components() - Download and extract several components at once
+- func warm_cache()     - Download the archives of several components into a cache
+- func install_key()    - Describe a set of components for Cache.install_tree()
+- func resolve_components() - Get the download URLs of many components at once
 - func infer_target()   - Infer the download target of the host OS
 - func infer_arch()     - Infer the architecture of the host OS
+- func trace_span()     - Record the time taken by a stage in the trace file
 - user_caches_root()    - Where programs should put their cache data
 - default_cache_dir()   - Default directory for mongodl cache data
 
@@ -16,24 +21,25 @@ Use '--help' for more information.
 
 import argparse
 import enum
+import functools
 import hashlib
+import io
+import itertools
 import json
 import logging
 import os
 import platform
+import random
 import re
 import shutil
-import sqlite3
-import ssl
 import sys
-import tarfile
-import textwrap
+import threading
 import time
 import urllib.error
-import urllib.request
+import urllib.parse
 import warnings
-import zipfile
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from fnmatch import fnmatch
 from pathlib import Path, PurePath, PurePosixPath
@@ -42,6 +48,7 @@ from typing import (
     TYPE_CHECKING,
     Any,
     Callable,
+    ContextManager,
     Iterable,
     Iterator,
     NamedTuple,
@@ -49,20 +56,84 @@ from typing import (
     cast,
 )
 
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
 LOGGER = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
 
-SSL_CONTEXT = ssl.create_default_context()
-try:
-    import certifi
+# The modules below are comparatively slow to import and only needed once a
+# download, extraction or cache query actually happens. They are imported in
+# the functions that use them so that "import mongodl" and quick invocations
+# like --help stay fast; mongodl is run many times in every task.
+if TYPE_CHECKING:
+    import http.client
+    import sqlite3
+    import ssl
+    import tarfile
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context() -> "ssl.SSLContext":
+    """
+    Get the SSL context used for HTTPS requests. It is created on first use,
+    trusting the certifi bundle in addition to the system store if available.
+    """
+    import ssl
+
+    ctx = ssl.create_default_context()
+    try:
+        import certifi
+
+        ctx.load_verify_locations(certifi.where())
+    except ImportError:
+        pass
+    return ctx
+
+
+def __getattr__(name: str) -> Any:
+    # Keep "mongodl.SSL_CONTEXT" working for existing callers.
+    if name == "SSL_CONTEXT":
+        return _ssl_context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    SSL_CONTEXT.load_verify_locations(certifi.where())
-except ImportError:
-    pass
 
 # These versions are used for performance benchmarking. Do not update to a newer version.
 PERF_VERSIONS = {"v6.0-perf": "6.0.6", "v8.0-perf": "8.0.1"}
 
+#: Default number of components that are downloaded and extracted concurrently
+DEFAULT_JOBS = 4
+#: Number of threads that extract the files of a .zip archive
+EXTRACT_JOBS = min(8, os.cpu_count() or 1)
+
+#: Size of the blocks in which downloaded files are written
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+#: Number of times an interrupted transfer is continued before giving up
+DOWNLOAD_RESUME_ATTEMPTS = 3
+#: Files smaller than this are never split into concurrent byte ranges
+PARALLEL_DOWNLOAD_MIN_SIZE = 32 * 1024 * 1024
+#: Number of download rows that are inserted at once when importing full.json
+IMPORT_BATCH_SIZE = 5000
+#: Seconds after which failed downloads are no longer retried
+RETRY_BUDGET = 600
+#: Seconds to wait for a response from a download server
+HTTP_TIMEOUT = 30
+#: Number of idle keep-alive connections that are kept open for each host
+POOL_MAX_IDLE = 8
+#: Number of redirects that are followed for a single download
+MAX_REDIRECTS = 10
+#: Seconds to wait for a connection to a download mirror when ranking mirrors
+MIRROR_PROBE_TIMEOUT = 2
+#: Seconds to wait for another process to release a lock on the cache database
+DB_LOCK_TIMEOUT = 120
+#: Seconds for which a fetched full.json is used without asking the server again
+FULL_JSON_TTL = 300
+#: Name of the member of a cache bundle that describes its content
+BUNDLE_MANIFEST = "mongodl-bundle.json"
+#: Name of the file in which install_tree() records what a directory contains
+INSTALL_MARKER = ".mongodl-install.json"
+
 #: Map common distribution names to the distribution named used in the MongoDB download list
 DISTRO_ID_MAP = {
     "elementary": "ubuntu",
@@ -161,9 +232,7 @@ def infer_target(version: Optional[str] = None) -> str:
                 return "osx"
         return "macos"
     # Now the tricky bit
-    cands = (Path(p) for p in ["/etc/os-release", "/usr/lib/os-release"])
-    existing = (p for p in cands if p.is_file())
-    found = next(iter(existing), None)
+    found = _os_release_file()
     if found:
         return infer_target_from_os_release(found)
     raise RuntimeError(
@@ -172,6 +241,15 @@ def infer_target(version: Optional[str] = None) -> str:
     )
 
 
+def _os_release_file() -> "Path | None":
+    """
+    Find the os-release file of the host system, if it has one.
+    """
+    cands = (Path(p) for p in ["/etc/os-release", "/usr/lib/os-release"])
+    existing = (p for p in cands if p.is_file())
+    return next(iter(existing), None)
+
+
 def infer_target_from_os_release(osr: Path) -> str:
     """
     Infer the download target based on the content of os-release
@@ -251,7 +329,7 @@ def default_cache_dir() -> Path:
 
 if TYPE_CHECKING:
     DownloadResult = NamedTuple(
-        "DownloadResult", [("is_changed", bool), ("path", Path)]
+        "DownloadResult", [("is_changed", bool), ("path", Path), ("sha256", str)]
     )
     DownloadableComponent = NamedTuple(
         "DownloadableComponent",
@@ -264,12 +342,40 @@ if TYPE_CHECKING:
             ("data_json", str),
         ],
     )
+    ComponentRequest = NamedTuple(
+        "ComponentRequest",
+        [
+            ("component", str),
+            ("version", str),
+            ("target", str),
+            ("arch", str),
+            ("edition", str),
+            ("out_dir", Path),
+            ("pattern", "str | None"),
+            ("strip_components", int),
+            ("latest_build_branch", "str | None"),
+        ],
+    )
 else:
-    DownloadResult = namedtuple("DownloadResult", ["is_changed", "path"])
+    DownloadResult = namedtuple("DownloadResult", ["is_changed", "path", "sha256"])
     DownloadableComponent = namedtuple(
         "DownloadableComponent",
         ["version", "target", "arch", "edition", "key", "data_json"],
     )
+    ComponentRequest = namedtuple(
+        "ComponentRequest",
+        [
+            "component",
+            "version",
+            "target",
+            "arch",
+            "edition",
+            "out_dir",
+            "pattern",
+            "strip_components",
+            "latest_build_branch",
+        ],
+    )
 
 #: Regular expression that matches the version numbers from 'full.json'
 VERSION_RE = re.compile(r"(\d+)\.(\d+)\.(\d+)(?:-([a-z]+)(\d+))?")
@@ -298,6 +404,14 @@ def version_tup(version: str) -> "tuple[int, int, int, int, int]":
     return tuple(map(int, (major, minor, patch, tag, tagnum)))
 
 
+def version_sort_key(tup: "tuple[int, int, int, int, int]") -> int:
+    """
+    Pack a version tuple into a single integer with the same ordering.
+    """
+    major, minor, patch, tag, tagnum = tup
+    return (((major * 1000 + minor) * 1000 + patch) * 10000 + tag) * 1000 + tagnum
+
+
 def collate_mdb_version(left: str, right: str) -> int:
     lhs = version_tup(left)
     rhs = version_tup(right)
@@ -318,51 +432,291 @@ def mdb_version_rapid(version: str) -> bool:
     return tup[1] > 0
 
 
-class DownloadRetrier:
-    """Class that handles retry logic.  It performs exponential backoff with a maximum delay of 10 minutes between retry attempts."""
+class _Tracer:
+    """
+    Write the spans recorded by trace_span() to a file, as JSON lines.
+    """
+
+    def __init__(self, path: "str | None") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, event: "dict[str, Any]") -> None:
+        line = json.dumps(event)
+        LOGGER.debug("trace: %s", line)
+        if not self.path:
+            return
+        with self._lock:
+            # Several processes may append to the same file
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_TRACER = _Tracer(os.environ.get("MONGODL_TRACE_FILE"))
+
+
+def set_trace_file(path: "Path | str | None") -> None:
+    """
+    Append the spans recorded by trace_span() to the given file, as one JSON
+    object per line. The default is taken from MONGODL_TRACE_FILE.
+    """
+    _TRACER.path = str(path) if path else None
+
+
+@contextmanager
+def trace_span(name: str, **attrs: "Any") -> "Iterator[dict[str, Any]]":
+    """
+    Record the time taken by one stage of the work, e.g. a transfer.
+
+    Yields a dict of attributes for the span, to which more can be added. If
+    a "bytes" attribute is set, the throughput is recorded as well. Spans are
+    logged at the DEBUG level, and written to the trace file, if any.
+    """
+    start = time.time()
+    t0 = time.perf_counter()
+    error = None  # type: str | None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        event = {
+            "span": name,
+            "start": round(start, 6),
+            "seconds": round(seconds, 6),
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            **attrs,
+        }
+        if isinstance(attrs.get("bytes"), int) and seconds > 0:
+            event["bytes_per_s"] = round(attrs["bytes"] / seconds)
+        if error is not None:
+            event["error"] = error
+        _TRACER.emit(event)
+
+
+class PermanentDownloadError(RuntimeError):
+    """
+    A download failed in a way that retrying will not fix, e.g. "404 Not Found".
+    """
+
+
+class RetryPolicy:
+    """
+    Decide whether, and after how long, to retry a failed download.
+
+    Permanent errors are not retried. Otherwise the delays use "decorrelated
+    jitter": each delay is drawn at random between 'base_delay' and three times
+    the previous delay, up to 'max_delay'. No retry is started after 'retries'
+    retries, or if it would start more than 'budget' seconds after the policy
+    was created.
+    """
 
-    def __init__(self, retries: int) -> None:
+    def __init__(
+        self,
+        retries: int,
+        budget: "float | None" = RETRY_BUDGET,
+        base_delay: float = 1.0,
+        max_delay: float = 600.0,
+    ) -> None:
         self.retries = retries
         self.attempt = 0
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._delay = base_delay
+        self._start = time.monotonic()
         assert self.retries >= 0
 
-    def retry(self) -> bool:
+    @staticmethod
+    def is_transient(error: BaseException) -> bool:
+        """
+        Whether the given error may go away when the operation is retried.
+        """
+        return not isinstance(error, PermanentDownloadError)
+
+    def retry(self, error: "BaseException | None" = None) -> bool:
+        """
+        Wait before the next attempt after the given 'error', and return True,
+        or return False if there should be no further attempt.
+        """
+        if error is not None and not self.is_transient(error):
+            return False
         if self.attempt >= self.retries:
             return False
+        delay = min(self.max_delay, random.uniform(self.base_delay, self._delay * 3))
+        self._delay = delay
+        elapsed = time.monotonic() - self._start
+        if self.budget is not None and elapsed + delay > self.budget:
+            LOGGER.warning(
+                f"Not retrying, the download time budget of {self.budget:.0f}s "
+                "would be exceeded"
+            )
+            return False
         self.attempt += 1
         LOGGER.warning(
-            f"Download attempt failed, retrying attempt {self.attempt} of {self.retries}"
+            f"Download attempt failed, retrying attempt {self.attempt} of "
+            f"{self.retries} in {delay:.1f}s"
         )
-        ten_minutes = 600
-        time.sleep(min(2 ** (self.attempt - 1), ten_minutes))
+        time.sleep(delay)
         return True
 
 
+#: The previous name of RetryPolicy
+DownloadRetrier = RetryPolicy
+
+
+def _add_missing_columns(
+    db: "sqlite3.Connection", table: str, columns: "dict[str, str]"
+) -> None:
+    """
+    Add the given columns to an existing table that was created by an older
+    version of mongodl.
+    """
+    have = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in have:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
 class CacheDB:
     """
     Abstract a mongodl cache SQLite database.
     """
 
-    def __init__(self, db: sqlite3.Connection) -> None:
+    #: Bump this when changing the tables that hold the full.json data
+    SCHEMA_VERSION = 4
+
+    def __init__(self, db: "sqlite3.Connection") -> None:
         self._db = db
         # Use a cursor to get access to lastrowid
         self._cursor = self._db.cursor()
+        # The connection is shared by download worker threads. Serialize all
+        # access to it, including whole transactions.
+        self._lock = threading.RLock()
 
     @staticmethod
     def open(fpath: Path) -> "CacheDB":
         """
         Open a caching database at the given filepath.
         """
-        db = sqlite3.connect(str(fpath), isolation_level=None)
+        import sqlite3
+
+        db = sqlite3.connect(
+            str(fpath),
+            isolation_level=None,
+            check_same_thread=False,
+            timeout=DB_LOCK_TIMEOUT,
+        )
         db.execute(r"""
             CREATE TABLE IF NOT EXISTS mdl_http_downloads (
             url TEXT NOT NULL UNIQUE,
             etag TEXT,
             last_modified TEXT
         )""")
-        db.create_collation("mdb_version", collate_mdb_version)
-        db.create_function("mdb_version_not_rc", 1, mdb_version_not_rc)
-        db.create_function("mdb_version_rapid", 1, mdb_version_rapid)
+        _add_missing_columns(
+            db,
+            "mdl_http_downloads",
+            {
+                "partial_etag": "TEXT",
+                # The URL that the validators above came from: the download URL,
+                # or the copy of the file on a mirror
+                "source": "TEXT",
+                "sha256": "TEXT",
+                "file_size": "INTEGER",
+                "file_mtime_ns": "INTEGER",
+                "fetched_at": "REAL",
+                "last_used": "REAL",
+                "expires": "REAL",
+            },
+        )
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_extractions (
+            key TEXT NOT NULL UNIQUE,
+            n_extracted INTEGER NOT NULL
+        )""")
+        _add_missing_columns(
+            db,
+            "mdl_extractions",
+            {"last_used": "REAL", "fingerprint": "TEXT"},
+        )
+        if db.execute("PRAGMA user_version").fetchone()[0] != CacheDB.SCHEMA_VERSION:
+            # The downloads tables are only copies of full.json and
+            # mongosh.json, and memos can be recomputed, so they are simply
+            # dropped and re-created on schema changes.
+            db.execute("DROP TABLE IF EXISTS mdl_components")
+            db.execute("DROP TABLE IF EXISTS mdl_downloads")
+            db.execute("DROP TABLE IF EXISTS mdl_versions")
+            db.execute("DROP TABLE IF EXISTS mdl_memo")
+            db.execute("DROP TABLE IF EXISTS mdl_mongosh_downloads")
+            db.execute(f"PRAGMA user_version = {CacheDB.SCHEMA_VERSION}")
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_versions (
+                version_id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                version TEXT NOT NULL,
+                githash TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                version_key INTEGER NOT NULL,
+                is_stable INTEGER NOT NULL,
+                is_rapid INTEGER NOT NULL
+            )
+        """)
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_downloads (
+                download_id INTEGER PRIMARY KEY,
+                version_id INTEGER NOT NULL REFERENCES mdl_versions,
+                target TEXT NOT NULL,
+                arch TEXT NOT NULL,
+                edition TEXT NOT NULL,
+                ar_url TEXT NOT NULL,
+                ar_debug_url TEXT,
+                data TEXT NOT NULL
+            )
+        """)
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_components (
+                component_id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                download_id INTEGER NOT NULL REFERENCES mdl_downloads,
+                data NOT NULL,
+                UNIQUE(key, download_id)
+            )
+        """)
+        # The downloads listed in mongosh.json (see mongosh_dl.py)
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_mongosh_downloads (
+                position INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                url TEXT NOT NULL,
+                sha256 TEXT
+            )
+        """)
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_memo (
+                key TEXT NOT NULL UNIQUE,
+                value TEXT NOT NULL,
+                from_downloads INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS mdl_versions_version_key "
+            "ON mdl_versions (version_key)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS mdl_downloads_version_id "
+            "ON mdl_downloads (version_id)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS mdl_downloads_platform "
+            "ON mdl_downloads (target, arch, edition, version_id)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS mdl_components_download_id "
+            "ON mdl_components (download_id, key)"
+        )
         return CacheDB(db)
 
     def __call__(
@@ -370,143 +724,257 @@ class CacheDB:
     ) -> "Iterable[sqlite3.Row]":
         """
         Execute a query with the given named parameters.
+
+        The result rows are fetched eagerly, since the underlying cursor is
+        shared with other threads.
+        """
+        with self._lock:
+            return self._cursor.execute(query, params).fetchall()
+
+    def executemany(
+        self, query: str, rows: "Iterable[dict[str, str | int | bool | float | None]]"
+    ) -> None:
+        """
+        Execute a query once for each set of named parameters in 'rows'.
         """
-        return self._cursor.execute(query, params)
+        with self._lock:
+            self._cursor.executemany(query, rows)
 
     @contextmanager
     def transaction(self) -> "Iterator[None]":
         """
         Create a context for a database transaction.
         """
-        if self._db.in_transaction:
-            yield
-            return
+        with self._lock:
+            if self._db.in_transaction:
+                yield
+                return
 
-        with self._db:
-            # Must do an explicit BEGIN because isolation_level=None
-            self("BEGIN")
-            yield
+            with self._db:
+                # Must do an explicit BEGIN because isolation_level=None
+                self("BEGIN")
+                yield
 
     def import_json_file(self, json_file: Path) -> None:
         """
         Import the given downloads content from the given JSON file
+
+        The file is decoded one version at a time, so the whole document is
+        never held in memory.
         """
-        with json_file.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        self.import_json_data(data)
+        with trace_span("import_full_json", bytes=json_file.stat().st_size):
+            with json_file.open("r", encoding="utf-8") as f:
+                with self.transaction():
+                    self._import_versions(_iter_json_array(f, "versions"))
 
-    def import_json_data(self, data: "Any") -> None:
+    def import_json_data(self, data: "Any", merge: bool = False) -> None:
         """
-        Import the given downloads content from the given JSON-like data
+        Import the given downloads content from the given JSON-like data.
+
+        If 'merge' is true, versions that are not listed in 'data' are kept.
         """
         with self.transaction():
-            self._import_json_data(data)
-
-    def _import_json_data(self, data: "Any") -> None:
-        # We're reloading everything, so just drop and re-create the tables.
-        # Bonus: We don't have to worry about schema changes
-        self("DROP TABLE IF EXISTS mdl_components")
-        self("DROP TABLE IF EXISTS mdl_downloads")
-        self("DROP TABLE IF EXISTS mdl_versions")
-        self(r"""
-            CREATE TABLE mdl_versions (
-                version_id INTEGER PRIMARY KEY,
-                date TEXT NOT NULL,
-                version TEXT NOT NULL,
-                githash TEXT NOT NULL
-            )
-        """)
-        self(r"""
-            CREATE TABLE mdl_downloads (
-                download_id INTEGER PRIMARY KEY,
-                version_id INTEGER NOT NULL REFERENCES mdl_versions,
-                target TEXT NOT NULL,
-                arch TEXT NOT NULL,
-                edition TEXT NOT NULL,
-                ar_url TEXT NOT NULL,
-                ar_debug_url TEXT,
-                data TEXT NOT NULL
-            )
-        """)
-        self(r"""
-            CREATE TABLE mdl_components (
-                component_id INTEGER PRIMARY KEY,
-                key TEXT NOT NULL,
-                download_id INTEGER NOT NULL REFERENCES mdl_downloads,
-                data NOT NULL,
-                UNIQUE(key, download_id)
-            )
-        """)
+            self._import_json_data(data, merge)
+
+    def _import_json_data(self, data: "Any", merge: bool = False) -> None:
+        self._import_versions(data["versions"], merge)
+
+    def _import_versions(self, versions: "Iterable[Any]", merge: bool = False) -> None:
+        """
+        Bring the downloads tables up-to-date with the given full.json versions.
 
-        for ver in data["versions"]:
+        Versions are identified by their version and githash, and compared by a
+        digest of their whole entry. Only new or changed versions are inserted, and versions that are no longer listed
+        are deleted (unless merging). Everything else is left untouched.
+        """
+        existing = {
+            (version, githash): (version_id, digest)
+            for version_id, version, githash, digest in self(
+                "SELECT version_id, version, githash, digest FROM mdl_versions"
+            )
+        }
+        keep = set()  # type: set[int]
+        replaced = set()  # type: set[int]
+        # We assign the row IDs ourselves so that rows can be batch-inserted
+        next_version_id = self._next_rowid("mdl_versions", "version_id")
+        next_dl_id = self._next_rowid("mdl_downloads", "download_id")
+        version_rows = []  # type: list[dict[str, Any]]
+        download_rows = []  # type: list[dict[str, Any]]
+        component_rows = []  # type: list[dict[str, Any]]
+        n_inserted = 0
+        for ver in versions:
+            if len(download_rows) >= IMPORT_BATCH_SIZE:
+                n_inserted += len(version_rows)
+                self._insert_rows(version_rows, download_rows, component_rows)
+                version_rows, download_rows, component_rows = [], [], []
             version = ver["version"]
             githash = ver["githash"]
-            date = ver["date"]
-            self(
-                r"""
-                INSERT INTO mdl_versions (date, version, githash)
-                VALUES (:date, :version, :githash)
-                """,
-                date=date,
-                version=version,
-                githash=githash,
+            downloads = ver["downloads"]
+            # Any change to an entry, like a republished archive, changes this
+            digest = hashlib.sha256(
+                json.dumps(ver, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+            have = existing.get((version, githash))
+            if have is not None and have[1] == digest:
+                # Unchanged version
+                version_id = have[0]
+                keep.add(version_id)
+                continue
+            if have is not None:
+                replaced.add(have[0])
+            version_id = next_version_id
+            next_version_id += 1
+            keep.add(version_id)
+            tup = version_tup(version)
+            version_rows.append(
+                {
+                    "version_id": version_id,
+                    "date": ver["date"],
+                    "version": version,
+                    "githash": githash,
+                    "digest": digest,
+                    "version_key": version_sort_key(tup),
+                    "is_stable": mdb_version_not_rc(version),
+                    "is_rapid": mdb_version_rapid(version),
+                }
             )
-            version_id = self._cursor.lastrowid
-            missing = set()
-            for dl in ver["downloads"]:
+            for dl in downloads:
                 arch = dl.get("arch", "null")
                 target = dl.get("target", "null")
                 # Normalize RHEL target names to include just the major version.
                 if target.startswith("rhel") and len(target) == 6:
                     target = target[:-1]
-                found = False
-                for distro in DISTRO_ID_TO_TARGET.values():
-                    if target in list(distro.values()):
-                        found = True
-                if not found and target not in TARGETS_THAT_ARE_NOT_DISTROS:
-                    missing.add(target)
-                edition = dl["edition"]
-                ar_url = dl["archive"]["url"]
-                ar_debug_url = dl["archive"].get("debug_symbols")
-                self(
-                    r"""
-                    INSERT INTO mdl_downloads (version_id,
-                                               target,
-                                               arch,
-                                               edition,
-                                               ar_url,
-                                               ar_debug_url,
-                                               data)
-                    VALUES (:version_id,
-                            :target,
-                            :arch,
-                            :edition,
-                            :ar_url,
-                            :ar_debug_url,
-                            :data)
-                    """,
-                    version_id=version_id,
-                    target=target,
-                    arch=arch,
-                    edition=edition,
-                    ar_url=ar_url,
-                    ar_debug_url=ar_debug_url,
-                    data=json.dumps(dl),
+                download_rows.append(
+                    {
+                        "download_id": next_dl_id,
+                        "version_id": version_id,
+                        "target": target,
+                        "arch": arch,
+                        "edition": dl["edition"],
+                        "ar_url": dl["archive"]["url"],
+                        "ar_debug_url": dl["archive"].get("debug_symbols"),
+                        "data": json.dumps(dl),
+                    }
                 )
-                dl_id = self._cursor.lastrowid
                 for key, data in dl.items():
                     if "url" not in data:
                         # Some fields aren't downloadable items. Skip them
                         continue
-                    self(
-                        r"""
-                        INSERT INTO mdl_components (key, download_id, data)
-                        VALUES (:key, :dl_id, :data)
-                        """,
-                        key=key,
-                        dl_id=dl_id,
-                        data=json.dumps(data),
+                    component_rows.append(
+                        {"key": key, "dl_id": next_dl_id, "data": json.dumps(data)}
                     )
+                next_dl_id += 1
+
+        stale = [
+            {"version_id": version_id}
+            for version_id, _ in existing.values()
+            if version_id in replaced or not (merge or version_id in keep)
+        ]
+        self.executemany(
+            r"""
+            DELETE FROM mdl_components WHERE download_id IN (
+                SELECT download_id FROM mdl_downloads WHERE version_id=:version_id
+            )
+            """,
+            stale,
+        )
+        self.executemany(
+            "DELETE FROM mdl_downloads WHERE version_id=:version_id", stale
+        )
+        self.executemany("DELETE FROM mdl_versions WHERE version_id=:version_id", stale)
+        n_inserted += len(version_rows)
+        self._insert_rows(version_rows, download_rows, component_rows)
+        if n_inserted or stale:
+            # Values derived from the old download list may no longer hold
+            self("DELETE FROM mdl_memo WHERE from_downloads")
+        LOGGER.debug(
+            "Imported %d new versions, deleted %d stale versions",
+            n_inserted,
+            len(stale),
+        )
+        if keep:
+            # Only the targets of the last listed version are validated
+            self._check_targets(version_id)
+
+    def _insert_rows(
+        self,
+        version_rows: "list[dict[str, Any]]",
+        download_rows: "list[dict[str, Any]]",
+        component_rows: "list[dict[str, Any]]",
+    ) -> None:
+        """
+        Batch-insert rows into the downloads tables.
+        """
+        self.executemany(
+            r"""
+            INSERT INTO mdl_versions (version_id,
+                                      date,
+                                      version,
+                                      githash,
+                                      digest,
+                                      version_key,
+                                      is_stable,
+                                      is_rapid)
+            VALUES (:version_id,
+                    :date,
+                    :version,
+                    :githash,
+                    :digest,
+                    :version_key,
+                    :is_stable,
+                    :is_rapid)
+            """,
+            version_rows,
+        )
+        self.executemany(
+            r"""
+            INSERT INTO mdl_downloads (download_id,
+                                       version_id,
+                                       target,
+                                       arch,
+                                       edition,
+                                       ar_url,
+                                       ar_debug_url,
+                                       data)
+            VALUES (:download_id,
+                    :version_id,
+                    :target,
+                    :arch,
+                    :edition,
+                    :ar_url,
+                    :ar_debug_url,
+                    :data)
+            """,
+            download_rows,
+        )
+        self.executemany(
+            r"""
+            INSERT INTO mdl_components (key, download_id, data)
+            VALUES (:key, :dl_id, :data)
+            """,
+            component_rows,
+        )
+
+    def _next_rowid(self, table: str, column: str) -> int:
+        """
+        Get an unused row ID that is greater than all existing ones.
+        """
+        rows = self(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")
+        return rows[0][0]
+
+    def _check_targets(self, version_id: int) -> None:
+        """
+        Report download targets of a version that are missing from
+        DISTRO_ID_TO_TARGET.
+        """
+        known = set(TARGETS_THAT_ARE_NOT_DISTROS)
+        for distro in DISTRO_ID_TO_TARGET.values():
+            known.update(distro.values())
+        rows = self(
+            "SELECT DISTINCT target FROM mdl_downloads WHERE version_id=:version_id",
+            version_id=version_id,
+        )
+        missing = [target for (target,) in rows if target not in known]
         if missing:
             LOGGER.error("Missing targets in DISTRO_ID_TO_TARGET:")
             for item in missing:
@@ -514,6 +982,81 @@ class CacheDB:
             if os.environ.get("VALIDATE_DISTROS") == "1":
                 sys.exit(1)
 
+    def find_versions(self, urls: "Iterable[str]") -> "set[int]":
+        """
+        Get the IDs of the versions that have a component with one of 'urls'.
+        """
+        found = set()  # type: set[int]
+        for url in urls:
+            rows = self(
+                r"""
+                SELECT DISTINCT version_id
+                  FROM mdl_components
+                  JOIN mdl_downloads USING(download_id)
+                WHERE instr(mdl_components.data, :quoted)
+                """,
+                quoted=json.dumps(url),
+            )
+            found.update(version_id for (version_id,) in rows)
+        return found
+
+    def export_versions(self, version_ids: "Iterable[int]") -> "list[Any]":
+        """
+        Get the given versions as full.json "versions" entries.
+        """
+        versions = []
+        for version_id in sorted(version_ids):
+            for version, date, githash in self(
+                "SELECT version, date, githash FROM mdl_versions "
+                "WHERE version_id=:version_id",
+                version_id=version_id,
+            ):
+                downloads = self(
+                    "SELECT data FROM mdl_downloads WHERE version_id=:version_id "
+                    "ORDER BY download_id",
+                    version_id=version_id,
+                )
+                versions.append(
+                    {
+                        "version": version,
+                        "date": date,
+                        "githash": githash,
+                        "downloads": [json.loads(data) for (data,) in downloads],
+                    }
+                )
+        return versions
+
+    def memo_get(self, key: str) -> "str | None":
+        """
+        Get the value that was stored for 'key' with memo_set(), if any.
+        """
+        rows = self("SELECT value FROM mdl_memo WHERE key=:key", key=key)
+        return rows[0][0] if rows else None
+
+    def memo_set(self, key: str, value: str, from_downloads: bool = False) -> None:
+        """
+        Remember 'value' for 'key'.
+
+        If 'from_downloads' is true, the value was derived from the download
+        list, and it is forgotten whenever the imported full.json changes.
+        Other values, like facts about the host, are kept.
+        """
+        self(
+            r"""
+            INSERT OR REPLACE INTO mdl_memo (key, value, from_downloads)
+            VALUES (:key, :value, :from_downloads)
+            """,
+            key=key,
+            value=value,
+            from_downloads=from_downloads,
+        )
+
+    def has_versions(self) -> bool:
+        """
+        Whether any full.json content has been imported.
+        """
+        return bool(self("SELECT 1 FROM mdl_versions LIMIT 1"))
+
     def iter_available(
         self,
         *,
@@ -522,34 +1065,38 @@ class CacheDB:
         arch: "str | None" = None,
         edition: "str | None" = None,
         component: "str | None" = None,
+        limit: "int | None" = None,
     ) -> "Iterable[DownloadableComponent]":
         """
         Iterate over the matching downloadable components according to the
-        given attribute filters.
+        given attribute filters, newest versions first.
         """
+        # Only filter on the given attributes, so that SQLite can use the
+        # indexes on the remaining columns.
+        conditions = []
+        if component is not None:
+            conditions.append("key=:component")
+        if target is not None:
+            conditions.append("target=:target")
+        if arch is not None:
+            conditions.append("arch=:arch")
+        if edition is not None:
+            conditions.append("edition=:edition")
+        if version == "latest-stable":
+            conditions.append("is_stable")
+        elif version == "rapid":
+            conditions.append("is_rapid")
+        elif version not in (None, "latest-release"):
+            conditions.append("(version=:version OR version LIKE :version_pattern)")
         rows = self(
-            r"""
+            f"""
             SELECT version, target, arch, edition, key, mdl_components.data
-              FROM mdl_components,
-                   mdl_downloads USING(download_id),
-                   mdl_versions USING(version_id)
-            WHERE (:component IS NULL OR key=:component)
-              AND (:target IS NULL OR target=:target)
-              AND (:arch IS NULL OR arch=:arch)
-              AND (:edition IS NULL OR edition=:edition)
-              AND (
-                  CASE
-                    WHEN :version='latest-release'
-                        THEN 1
-                    WHEN :version='latest-stable'
-                        THEN mdb_version_not_rc(version)
-                    WHEN :version='rapid'
-                        THEN mdb_version_rapid(version)
-                    WHEN :version IS NULL
-                        THEN 1
-                    ELSE version=:version OR version LIKE :version_pattern
-                  END)
-            ORDER BY version COLLATE mdb_version DESC
+              FROM mdl_components
+              JOIN mdl_downloads USING(download_id)
+              JOIN mdl_versions USING(version_id)
+            WHERE {" AND ".join(conditions) or "1"}
+            ORDER BY version_key DESC
+            LIMIT :limit
             """,
             version=version,
             version_pattern=f"{version}.%",
@@ -557,11 +1104,149 @@ class CacheDB:
             arch=arch,
             edition=edition,
             component=component,
+            limit=-1 if limit is None else limit,
         )
         for row in rows:
             yield DownloadableComponent(*row)  # type: ignore
 
 
+class _PooledResponse:
+    """
+    A response from _ConnectionPool. Its connection goes back to the pool when
+    the response is closed after its body was read to the end.
+    """
+
+    def __init__(
+        self,
+        pool: "_ConnectionPool",
+        key: "tuple[str, str]",
+        conn: "http.client.HTTPConnection",
+        resp: "http.client.HTTPResponse",
+    ) -> None:
+        self._pool = pool
+        self._key = key
+        self._conn = conn  # type: http.client.HTTPConnection | None
+        self._resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def read(self, amt: "int | None" = None) -> bytes:
+        return self._resp.read(amt)
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._resp.length == 0:
+            # E.g. a "304 Not Modified". Reading marks the response as done.
+            self._resp.read()
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._pool._release(self._key, conn)
+        else:
+            # The rest of the body is still in flight, so drop the connection
+            self._resp.close()
+            conn.close()
+
+    def __enter__(self) -> "_PooledResponse":
+        return self
+
+    def __exit__(self, *exc_info: "Any") -> None:
+        self.close()
+
+
+class _ConnectionPool:
+    """
+    Keep HTTP/1.1 connections open for reuse by later requests to the same
+    host, so that TCP and TLS handshakes are only paid once per host.
+    """
+
+    def __init__(self) -> None:
+        self._idle = {}  # type: dict[tuple[str, str], list[http.client.HTTPConnection]]
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: "dict[str, str]") -> _PooledResponse:
+        """
+        Issue a GET request for 'url', following redirects.
+        """
+        for _ in range(MAX_REDIRECTS):
+            resp = self._request(url, headers)
+            location = resp.headers.get("Location")
+            if resp.status not in (301, 302, 303, 307, 308) or not location:
+                return resp
+            # Consume the (short) body, so that the connection can be reused
+            resp.read()
+            resp.close()
+            url = urllib.parse.urljoin(url, location)
+        raise RuntimeError(f"Too many redirects for [{url}]")
+
+    def _request(self, url: str, headers: "dict[str, str]") -> _PooledResponse:
+        import http.client
+
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = {
+            # The same agent that urlopen() would send
+            "User-Agent": "Python-urllib/%d.%d" % sys.version_info[:2],
+            **headers,
+        }
+
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                if not reused:
+                    with trace_span("connect", host=parts.netloc):
+                        conn.connect()
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused:
+                    # The server has closed the idle connection. Try another.
+                    continue
+                raise
+            return _PooledResponse(self, key, conn, resp)
+
+    def _acquire(
+        self, key: "tuple[str, str]"
+    ) -> "tuple[http.client.HTTPConnection, bool]":
+        """
+        Get an idle connection for 'key', or a new one. Also returns whether
+        the connection was used before.
+        """
+        import http.client
+
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, netloc = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                netloc, timeout=HTTP_TIMEOUT, context=_ssl_context()
+            )  # type: http.client.HTTPConnection
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=HTTP_TIMEOUT)
+        return conn, False
+
+    def _release(
+        self, key: "tuple[str, str]", conn: "http.client.HTTPConnection"
+    ) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < POOL_MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+#: Connections shared by all Cache objects of this process
+_HTTP_POOL = _ConnectionPool()
+
+
 class Cache:
     """
     Abstraction over a mongodl downloads cache directory.
@@ -570,6 +1255,23 @@ class Cache:
     def __init__(self, dirpath: Path, db: CacheDB) -> None:
         self._dirpath = dirpath
         self._db = db
+        #: Split large downloads into this many concurrent byte range requests
+        self.download_parts = 1
+        #: Keep extracted archive trees in the cache for reuse
+        self.extract_cache = True
+        #: If set, prune() the cache down to this many bytes after use
+        self.max_size = None  # type: int | None
+        #: Seconds for which refresh_full_json() trusts the previous download.
+        #: If None, the lifetime sent by the server is used, or FULL_JSON_TTL.
+        self.full_json_ttl = None  # type: float | None
+        #: Base URLs of mirrors to try before the original download URLs.
+        #: See _mirror_sources() for the layout of a mirror.
+        self.mirrors = _env_mirrors()
+        #: Only use files that are already in the cache. Set MONGODL_OFFLINE=1
+        #: to enable this by default.
+        self.offline = os.environ.get("MONGODL_OFFLINE", "") not in ("", "0")
+        self._mirror_order = None  # type: list[str] | None
+        self._mirror_lock = threading.Lock()
 
     @staticmethod
     def open_default() -> "Cache":
@@ -584,7 +1286,9 @@ class Cache:
         Open or create a cache directory at the given path.
         """
         _mkdir(dirpath)
-        db = CacheDB.open(dirpath / "data.db")
+        # Serialize the creation and migration of the database tables
+        with _file_lock(dirpath / "locks" / "data-db.lock"):
+            db = CacheDB.open(dirpath / "data.db")
         return Cache(dirpath, db)
 
     @property
@@ -592,60 +1296,795 @@ class Cache:
         """The backing cache database"""
         return self._db
 
-    def download_file(self, url: str) -> DownloadResult:
+    def infer_target(self, version: Optional[str] = None) -> str:
+        """
+        Infer the download target of the current host system, like
+        infer_target().
+
+        The target of a Linux host is remembered in the database, keyed by its
+        os-release content and architecture, so that it is mapped only once.
+        """
+        osr = _os_release_file()
+        if sys.platform in ("win32", "darwin") or osr is None:
+            return infer_target(version)
+        fingerprint = hashlib.sha256(osr.read_bytes())
+        fingerprint.update(infer_arch().encode())
+        # A newer mongodl may map the host differently
+        fingerprint.update(str(os.stat(__file__).st_mtime_ns).encode())
+        key = f"target:{fingerprint.hexdigest()}"
+        target = self._db.memo_get(key)
+        if target is None:
+            target = infer_target_from_os_release(osr)
+            self._db.memo_set(key, target)
+        return target
+
+    def download_file(
+        self,
+        url: str,
+        ttl: "float | None" = None,
+        default_ttl: "float | None" = None,
+    ) -> DownloadResult:
         """
         Obtain a local copy of the file at the given URL.
+
+        The file is first written to a ".part" file next to its final path.
+        If the transfer is interrupted, it is continued with a "Range" request,
+        both within this call and by later calls for the same URL.
+
+        The SHA-256 of the file is computed while it is downloaded and stored
+        with the file's HTTP validators, so it is not re-read on a cache hit.
+
+        Downloads of the same URL are serialized across processes sharing the
+        cache directory. If another process fetched the file while we waited
+        for it, its copy is used without sending another request.
+
+        A cached file is also used without a request while it is fresh: for
+        'ttl' seconds after it was last fetched or revalidated, if given (0
+        always revalidates). Otherwise, if 'default_ttl' is given, for the
+        "max-age" the server sent in "Cache-Control", or else for 'default_ttl'
+        seconds. Without either, the file is always revalidated.
+        """
+        started = time.time()
+        with self._locked_url(url) as waited:
+            result = None
+            if waited:
+                result = self.fetched_since(url, started)
+                if result is not None:
+                    LOGGER.info(
+                        "Using %s as fetched by another process", result.path.name
+                    )
+            if result is None:
+                result = self._download_file(url, ttl, default_ttl)
+            self._db(
+                "UPDATE mdl_http_downloads SET last_used=:now WHERE url=:url",
+                url=url,
+                now=time.time(),
+            )
+        return result
+
+    def fetched_since(self, url: str, since: float) -> "DownloadResult | None":
+        """
+        Get the cached copy of the file at 'url', if it was fetched or
+        revalidated at or after the time 'since' and is still intact.
         """
         info = self._db(
-            "SELECT etag, last_modified " "FROM mdl_http_downloads WHERE url=:url",
+            "SELECT sha256, file_size, file_mtime_ns, fetched_at "
+            "FROM mdl_http_downloads WHERE url=:url",
             url=url,
         )
-        etag = None  # type: str|None
+        row = next(iter(info), None)
+        if row is None:
+            return None
+        sha256, file_size, file_mtime, fetched_at = row
+        dest = self._file_path(url)
+        if not (sha256 and fetched_at and fetched_at >= since and dest.is_file()):
+            return None
+        stat = dest.stat()
+        if (stat.st_size, stat.st_mtime_ns) != (file_size, file_mtime):
+            return None
+        return DownloadResult(False, dest, sha256)
+
+    def _file_path(self, url: str) -> Path:
+        """
+        Get the path of the cached copy of the file at 'url'.
+        """
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:4]
+        return self._dirpath / "files" / digest / PurePosixPath(url).name
+
+    def _locked_url(self, url: str) -> "ContextManager[bool]":
+        """
+        Hold the lock for downloading the file at 'url'.
+        """
+        return self._locked(
+            "dl-" + hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        )
+
+    @contextmanager
+    def _locked(self, name: str) -> "Iterator[bool]":
+        """
+        Hold the cache-wide lock with the given name, like _file_lock().
+        """
+        with _file_lock(self._dirpath / "locks" / f"{name}.lock") as waited:
+            yield waited
+
+    def _download_file(
+        self, url: str, ttl: "float | None", default_ttl: "float | None"
+    ) -> DownloadResult:
+        """
+        Implement download_file(), while holding the lock for 'url'.
+
+        The file is requested from each mirror that may have it, fastest first,
+        and then from 'url' itself. A mirror that fails to deliver the whole
+        file is skipped for this file.
+        """
+        import http.client
+
+        info = self._db(
+            "SELECT etag, last_modified, partial_etag, source, "
+            "       sha256, file_size, file_mtime_ns, fetched_at, expires "
+            "FROM mdl_http_downloads WHERE url=:url",
+            url=url,
+        )
+        row = next(iter(info), (None,) * 9)  # type: Any
+        sha256 = None  # type: str|None
+        file_size = None  # type: int|None
+        file_mtime = None  # type: int|None
+        fetched_at = None  # type: float|None
+        expires = None  # type: float|None
+        sha256, file_size, file_mtime, fetched_at, expires = row[4:]
+        if ttl is not None:
+            # The caller's window takes precedence over the server's
+            expires = fetched_at + ttl if fetched_at else None
+        elif default_ttl is None:
+            expires = None
+        elif expires is None and fetched_at:
+            # The server did not say for how long the file stays fresh
+            expires = fetched_at + default_ttl
+        dest = self._file_path(url)
+        file_name = dest.name
+        if self.offline:
+            if not dest.is_file():
+                raise RuntimeError(f"[{url}] is not in the cache, and we are offline")
+            LOGGER.info("Using cached file %s (offline)", file_name)
+            stat = dest.stat()
+            if not (
+                sha256 and (stat.st_size, stat.st_mtime_ns) == (file_size, file_mtime)
+            ):
+                sha256 = _file_sha256(dest)
+            return DownloadResult(False, dest, sha256)
+        if (
+            sha256
+            and expires is not None
+            and time.time() < expires
+            and dest.is_file()
+            and (dest.stat().st_size, dest.stat().st_mtime_ns)
+            == (file_size, file_mtime)
+        ):
+            LOGGER.info("Using cached file %s (still fresh)", file_name)
+            return DownloadResult(False, dest, sha256)
+
+        for source in _mirror_sources(self._ranked_mirrors(), url):
+            try:
+                return self._download_from(url, source, row)
+            except PermanentDownloadError as e:
+                # The mirror does not have this file
+                LOGGER.info("Could not get %s from mirror (%s)", source, e)
+            except (OSError, http.client.HTTPException, RuntimeError) as e:
+                LOGGER.warning("Could not get %s from mirror (%s)", source, e)
+                if not isinstance(e, RuntimeError):
+                    self._drop_mirror(source)
+        return self._download_from(url, url, row)
+
+    def _download_from(self, url: str, source: str, row: "Any") -> DownloadResult:
+        """
+        Download the file at 'url' from 'source' (either 'url' itself or its
+        copy on a mirror). 'row' holds the columns that _download_file() read
+        from mdl_http_downloads.
+
+        The stored HTTP validators are only sent to the source that they came
+        from, and are replaced by those of 'source'.
+        """
+        etag = None  # type: str|None
         modtime = None  # type: str|None
-        etag, modtime = next(iter(info), (None, None))  # type: ignore
+        partial_etag = None  # type: str|None
+        validated_by = None  # type: str|None
+        sha256 = None  # type: str|None
+        file_size = None  # type: int|None
+        file_mtime = None  # type: int|None
+        (
+            etag,
+            modtime,
+            partial_etag,
+            validated_by,
+            sha256,
+            file_size,
+            file_mtime,
+        ) = row[:7]
+        if (validated_by or url) != source:
+            # Validators of one server mean nothing to another
+            etag = modtime = partial_etag = None
         headers = {}  # type: dict[str, str]
         if etag:
             headers["If-None-Match"] = etag
         if modtime:
             headers["If-Modified-Since"] = modtime
-        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:4]
-        file_name = PurePosixPath(url).name
-        dest = self._dirpath / "files" / digest / file_name
+        dest = self._file_path(url)
+        file_name = dest.name
+        part = dest.with_name(file_name + ".part")
         if not dest.exists():
             headers = {}
-        req = urllib.request.Request(url, headers=headers)
-
-        try:
-            resp = urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=30)
-        except urllib.error.HTTPError as e:
-            if e.code != 304:
-                raise RuntimeError(f"Failed to download [{url}]") from e
+        offset = 0
+        if partial_etag and part.is_file():
+            # Continue a previous interrupted download of this file
+            offset = part.stat().st_size
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = partial_etag
+
+        resp = self._open_url(source, headers)
+        if resp.status == 304:
+            resp.close()
+            if part.is_file():
+                # A newer version of the file was partially downloaded
+                part.unlink()
             assert dest.is_file(), (
                 "The download cache is missing an expected file",
                 dest,
             )
             LOGGER.info("Using cached file %s", file_name)
-            return DownloadResult(False, dest)
+            stat = dest.stat()
+            unchanged = (stat.st_size, stat.st_mtime_ns) == (file_size, file_mtime)
+            if not (sha256 and unchanged):
+                # The file was modified, or it predates digest tracking
+                sha256 = _file_sha256(dest)
+            # The validators are stored again, in case an attempt on another
+            # source replaced them in the meantime
+            self._db(
+                "UPDATE mdl_http_downloads "
+                "SET etag=:etag, last_modified=:modtime, partial_etag=NULL, "
+                "    source=:source, sha256=:sha256, file_size=:size, "
+                "    file_mtime_ns=:mtime, fetched_at=:now, expires=:expires "
+                "WHERE url=:url",
+                url=url,
+                etag=etag,
+                modtime=modtime,
+                source=source,
+                sha256=sha256,
+                size=stat.st_size,
+                mtime=stat.st_mtime_ns,
+                now=time.time(),
+                expires=_response_expiry(resp),
+            )
+            return DownloadResult(False, dest, sha256)
 
         _mkdir(dest.parent)
-        got_etag = resp.getheader("ETag")
-        got_modtime = resp.getheader("Last-Modified")
-        got_len = int(resp.getheader("Content-Length"))
-        with dest.open("wb") as of:
-            shutil.copyfileobj(resp, of, length=got_len)
-        file_size = dest.stat().st_size
-        if file_size != got_len:
+        got_etag = resp.headers.get("ETag")
+        got_modtime = resp.headers.get("Last-Modified")
+        got_len = _response_total_size(resp)
+        resumable = bool(got_etag) and (
+            resp.status == 206 or resp.headers.get("Accept-Ranges") == "bytes"
+        )
+        with trace_span("transfer", url=source) as span:
+            if (
+                resp.status == 200
+                and resumable
+                and got_len is not None
+                and self.download_parts > 1
+                and got_len >= PARALLEL_DOWNLOAD_MIN_SIZE
+            ):
+                self._download_parts(source, resp, part, got_len, cast(str, got_etag))
+                # The ranges arrive out of order, so hash the file once they are done
+                sha256 = _file_sha256(part)
+            else:
+                if resp.status == 206:
+                    LOGGER.info(
+                        "Resuming download of %s at %d bytes", file_name, offset
+                    )
+                else:
+                    offset = 0
+                # Remember the validator, so a later call can continue the
+                # download. The other validators of a different source no
+                # longer apply.
+                self._db(
+                    "INSERT OR IGNORE INTO mdl_http_downloads (url) VALUES (:url)",
+                    url=url,
+                )
+                self._db(
+                    "UPDATE mdl_http_downloads "
+                    "SET etag=CASE WHEN COALESCE(source, url)=:source THEN etag END, "
+                    "    last_modified=CASE WHEN COALESCE(source, url)=:source "
+                    "                  THEN last_modified END, "
+                    "    partial_etag=:etag, source=:source "
+                    "WHERE url=:url",
+                    url=url,
+                    source=source,
+                    etag=got_etag if resumable else None,
+                )
+                hasher = hashlib.sha256()
+                with part.open("r+b" if offset else "wb") as of:
+                    # Hash the part of the file that we already have
+                    _copy_response(of, None, offset, hasher)
+                    of.truncate()
+                    self._download_range(source, resp, of, got_len, got_etag, hasher)
+                sha256 = hasher.hexdigest()
+            file_size = part.stat().st_size
+            span["bytes"] = file_size - offset
+        if got_len is not None and file_size != got_len:
             raise RuntimeError(
                 f"File size: {file_size} does not match download size: {got_len}"
             )
+        os.replace(str(part), str(dest))
+        stat = dest.stat()
         self._db(
-            "INSERT OR REPLACE INTO mdl_http_downloads (url, etag, last_modified) "
-            "VALUES (:url, :etag, :mtime)",
+            "INSERT OR REPLACE INTO mdl_http_downloads "
+            "(url, etag, last_modified, source, sha256, file_size, file_mtime_ns, "
+            " fetched_at, expires) "
+            "VALUES (:url, :etag, :mtime, :source, :sha256, :size, :file_mtime, "
+            "        :now, :expires)",
             url=url,
             etag=got_etag,
             mtime=got_modtime,
+            source=source,
+            sha256=sha256,
+            size=stat.st_size,
+            file_mtime=stat.st_mtime_ns,
+            now=time.time(),
+            expires=_response_expiry(resp),
+        )
+        return DownloadResult(True, dest, sha256)
+
+    def expand_archive(
+        self,
+        ar: Path,
+        sha256: str,
+        dest: Path,
+        pattern: "str | None",
+        strip_components: int,
+        test: bool,
+    ) -> "ExpandResult":
+        """
+        Expand the archive members from 'ar' into 'dest', like _expand_archive().
+
+        The extracted tree is kept in the cache directory, keyed by the
+        archive's SHA-256 and the extraction options. Later extractions with
+        the same key are placed into 'dest' as hard links to the cached tree
+        (or as copies, if links are not possible), without reading the archive.
+
+        A file in 'dest' that is changed in place also changes the cached tree
+        through its link. So the tree is only reused while the sizes, modes
+        and modification times of its files are as they were extracted.
+        """
+        if test or not self.extract_cache:
+            return _expand_archive(ar, dest, pattern, strip_components, test=test)
+        key = hashlib.sha256(
+            f"{sha256}\0{pattern or ''}\0{strip_components}".encode()
+        ).hexdigest()[:32]
+        tree = self._dirpath / "extracted" / key
+        # prune() takes the same lock, so the tree is not removed while it is
+        # being linked
+        with self._locked(f"ex-{key}"):
+            n_extracted = self._extract_tree(
+                ar, key, tree, pattern, strip_components, test
+            )
+            with trace_span("link_tree", archive=ar.name, files=n_extracted):
+                _link_tree(tree, dest)
+        return _expand_result(n_extracted, pattern, strip_components, test=False)
+
+    def _extract_tree(
+        self,
+        ar: Path,
+        key: str,
+        tree: Path,
+        pattern: "str | None",
+        strip_components: int,
+        test: bool,
+    ) -> int:
+        """
+        Ensure the cached extraction 'tree' of 'ar', returning its file count.
+        """
+        info = self._db(
+            "SELECT n_extracted, fingerprint FROM mdl_extractions WHERE key=:key",
+            key=key,
+        )
+        row = next(iter(info), None)
+        intact = (
+            row is not None
+            and tree.is_dir()
+            and row[1] is not None
+            and row[1] == _tree_fingerprint(tree)
+        )
+        if row is not None and tree.is_dir() and not intact:
+            LOGGER.warning(
+                "The cached extraction of %s was modified, extracting it again",
+                ar.name,
+            )
+        if intact:
+            LOGGER.info("Using cached extraction of %s", ar.name)
+            n_extracted = row[0]
+            self._db(
+                "UPDATE mdl_extractions SET last_used=:now WHERE key=:key",
+                key=key,
+                now=time.time(),
+            )
+        else:
+            LOGGER.debug(f"Extract from: [{ar.name}]")
+            LOGGER.debug(f"        into: [{tree}]")
+            staging = tree.with_name(f"{key}.tmp-{os.getpid()}-{threading.get_ident()}")
+            shutil.rmtree(str(staging), ignore_errors=True)
+            _mkdir(staging)
+            n_extracted = _expand_members(ar, staging, pattern, strip_components, test)
+            shutil.rmtree(str(tree), ignore_errors=True)
+            try:
+                os.replace(str(staging), str(tree))
+            except OSError:
+                # Someone else placed the same tree concurrently. Use theirs.
+                shutil.rmtree(str(staging), ignore_errors=True)
+            self._db(
+                "INSERT OR REPLACE INTO mdl_extractions "
+                "(key, n_extracted, fingerprint, last_used) "
+                "VALUES (:key, :n, :fingerprint, :now)",
+                key=key,
+                n=n_extracted,
+                fingerprint=_tree_fingerprint(tree),
+                now=time.time(),
+            )
+        return n_extracted
+
+    def prune(self, max_size: int) -> int:
+        """
+        Remove the least recently used downloaded files and extracted trees
+        until the cache holds at most 'max_size' bytes of them. The download
+        metadata (full.json and mongosh.json) is always kept, and extracted
+        files only count while no output directory links to them.
+
+        Returns the number of bytes that were removed.
+        """
+        entries = []  # type: list[tuple[float, int, str, str]]
+        for url, last_used in self._db("SELECT url, last_used FROM mdl_http_downloads"):
+            if urllib.parse.urlparse(url).path.endswith(".json"):
+                # The downloads tables are built from these, and only refreshed
+                # when they change (see refresh_full_json())
+                continue
+            path = self._file_path(url)
+            part = path.with_name(path.name + ".part")
+            size = sum(p.stat().st_size for p in (path, part) if p.is_file())
+            entries.append((last_used or 0, size, "dl", url))
+        for key, last_used in self._db("SELECT key, last_used FROM mdl_extractions"):
+            # Files that are still hard-linked from an output directory take
+            # up their space until that is removed, so removing them from the
+            # cache frees nothing. Such trees are kept.
+            size = _tree_size(self._dirpath / "extracted" / key, unshared=True)
+            if size:
+                entries.append((last_used or 0, size, "ex", key))
+
+        total = sum(e[1] for e in entries)
+        removed = 0
+        for last_used, size, kind, key in sorted(entries):
+            if total <= max_size:
+                break
+            if self._evict(kind, key, last_used):
+                total -= size
+                removed += size
+        LOGGER.info(
+            "Pruned %.1f MiB from the cache, %.1f MiB remain",
+            removed / 1024**2,
+            total / 1024**2,
+        )
+        return removed
+
+    def _evict(self, kind: str, key: str, last_used: float) -> bool:
+        """
+        Remove a cache entry found by prune(), unless it was used since.
+        """
+        if kind == "dl":
+            table, column, lock = "mdl_http_downloads", "url", self._locked_url(key)
+        else:
+            table, column, lock = "mdl_extractions", "key", self._locked(f"ex-{key}")
+        with lock:
+            info = self._db(
+                f"SELECT last_used FROM {table} WHERE {column}=:key", key=key
+            )
+            row = next(iter(info), None)
+            if row is None or (row[0] or 0) != last_used:
+                return False
+            LOGGER.debug("Evicting %s", key)
+            self._db(f"DELETE FROM {table} WHERE {column}=:key", key=key)
+            if kind == "dl":
+                path = self._file_path(key)
+                for p in (path, path.with_name(path.name + ".part")):
+                    if p.is_file():
+                        p.unlink()
+            else:
+                shutil.rmtree(
+                    str(self._dirpath / "extracted" / key), ignore_errors=True
+                )
+        return True
+
+    def export_bundle(self, bundle: Path, urls: "Iterable[str]") -> None:
+        """
+        Write the cached files of the given URLs (see warm_cache()) into the
+        tar file 'bundle',
+        along with the download list entries of the versions that they belong
+        to. Use import_bundle() to load it into another cache.
+        """
+        import tarfile
+
+        urls = list(urls)
+        versions = self._db.export_versions(self._db.find_versions(urls))
+        files = []
+        with tarfile.open(str(bundle), "w") as tf:
+            for idx, url in enumerate(urls):
+                info = self._db(
+                    "SELECT etag, last_modified, sha256 "
+                    "FROM mdl_http_downloads WHERE url=:url",
+                    url=url,
+                )
+                etag, modtime, sha256 = next(iter(info), (None, None, None))
+                path = self._file_path(url)
+                if sha256 is None or not path.is_file():
+                    raise RuntimeError(f"[{url}] is not in the cache")
+                name = f"files/{idx}/{path.name}"
+                tf.add(str(path), arcname=name)
+                files.append(
+                    {
+                        "url": url,
+                        "name": name,
+                        "sha256": sha256,
+                        "etag": etag,
+                        "last_modified": modtime,
+                    }
+                )
+            manifest = json.dumps({"versions": versions, "files": files}).encode()
+            member = tarfile.TarInfo(BUNDLE_MANIFEST)
+            member.size = len(manifest)
+            member.mtime = int(time.time())
+            tf.addfile(member, io.BytesIO(manifest))
+        LOGGER.info(
+            "Exported %d files and %d versions to %s", len(files), len(versions), bundle
+        )
+
+    def import_bundle(self, bundle: Path) -> None:
+        """
+        Load a bundle written by export_bundle() into this cache. Its versions
+        are merged into the download list, and its files are verified and
+        stored as if they were downloaded from their URLs.
+        """
+        import tarfile
+
+        with tarfile.open(str(bundle), "r:*") as tf:
+            with _extractfile(tf, BUNDLE_MANIFEST) as f:
+                manifest = json.load(f)
+            self._db.import_json_data({"versions": manifest["versions"]}, merge=True)
+            for item in manifest["files"]:
+                url = item["url"]
+                dest = self._file_path(url)
+                part = dest.with_name(dest.name + ".part")
+                hasher = hashlib.sha256()
+                with self._locked_url(url):
+                    _mkdir(dest.parent)
+                    with _extractfile(tf, item["name"]) as src, part.open("wb") as of:
+                        _copy_response(src, of, None, hasher)
+                    if hasher.hexdigest() != item["sha256"]:
+                        part.unlink()
+                        raise RuntimeError(f"Incorrect SHA-256 for {item['name']}")
+                    os.replace(str(part), str(dest))
+                    stat = dest.stat()
+                    self._db(
+                        "INSERT OR REPLACE INTO mdl_http_downloads "
+                        "(url, etag, last_modified, sha256, file_size, file_mtime_ns, "
+                        " fetched_at, last_used) "
+                        "VALUES (:url, :etag, :mtime, :sha256, :size, :file_mtime, "
+                        "        :now, :now)",
+                        url=url,
+                        etag=item["etag"],
+                        mtime=item["last_modified"],
+                        sha256=item["sha256"],
+                        size=stat.st_size,
+                        file_mtime=stat.st_mtime_ns,
+                        now=time.time(),
+                    )
+        LOGGER.info(
+            "Imported %d files and %d versions from %s",
+            len(manifest["files"]),
+            len(manifest["versions"]),
+            bundle,
         )
-        return DownloadResult(True, dest)
+
+    @contextmanager
+    def install_tree(self, dest: Path, key: "Any" = None) -> "Iterator[Path | None]":
+        """
+        Create a new directory tree for 'dest' next to it, then put it in place.
+
+        Yields a staging directory that is a sibling of 'dest', to be filled by
+        the caller. When the context exits normally, the current 'dest' is
+        renamed to "<dest>.prev" (replacing an older one) and the staging
+        directory is renamed to 'dest'. So 'dest' is never left with only some
+        of its files. If the context raises, the staging directory is removed
+        and 'dest' is left as it was.
+
+        'key' is a JSON-compatible description of what the tree will contain
+        (see install_key()), or a function that returns one. It is recorded in
+        a marker file. If 'dest' already has a marker with an equal key, None
+        is yielded instead: the caller should not create the tree, and 'dest'
+        is kept. If "<dest>.prev" has an equal key, it is swapped back into
+        place, and None is yielded as well.
+
+        A function is called again once the tree is created, and the marker
+        records what it returns then. So a key that depends on the files that
+        were just downloaded (like that of a "latest" build) is recorded too.
+        """
+        dest = dest.absolute()
+        describe = key if callable(key) else lambda: key
+        name = "in-" + hashlib.sha256(str(dest).encode("utf-8")).hexdigest()[:16]
+        with self._locked(name):
+            staging = dest.with_name(dest.name + ".staging")
+            prev = dest.with_name(dest.name + ".prev")
+            wanted = _json_roundtrip(describe())
+            if wanted is not None and _read_install_marker(dest) == wanted:
+                LOGGER.info("%s is already up-to-date", dest)
+                yield None
+                return
+            # Remove what an interrupted run may have left behind
+            shutil.rmtree(staging, ignore_errors=True)
+            if wanted is not None and _read_install_marker(prev) == wanted:
+                LOGGER.info("Restoring %s from %s", dest, prev)
+                # Swap the two trees, keeping the current one as the previous
+                if dest.exists():
+                    os.replace(dest, staging)
+                os.replace(prev, dest)
+                if staging.exists():
+                    os.replace(staging, prev)
+                yield None
+                return
+            _mkdir(staging)
+            try:
+                yield staging
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            installed = describe()
+            if installed is not None:
+                (staging / INSTALL_MARKER).write_text(
+                    json.dumps(installed), encoding="utf-8"
+                )
+            shutil.rmtree(prev, ignore_errors=True)
+            if dest.exists():
+                os.replace(dest, prev)
+            os.replace(staging, dest)
+
+    def discard_file(self, url: str) -> None:
+        """
+        Forget the cached copy of the file at the given URL, so that the next
+        download_file() fetches it again.
+        """
+        self._db("DELETE FROM mdl_http_downloads WHERE url=:url", url=url)
+
+    def _drop_mirror(self, source: str) -> None:
+        """
+        Stop using the mirror that 'source' is on, since it cannot be reached.
+        """
+        with self._mirror_lock:
+            order = self._mirror_order or []
+            self._mirror_order = [m for m in order if not source.startswith(m + "/")]
+
+    def _ranked_mirrors(self) -> "list[str]":
+        """
+        Get the reachable mirrors, fastest first. They are probed once.
+        """
+        with self._mirror_lock:
+            if self._mirror_order is None:
+                self._mirror_order = _rank_mirrors(self.mirrors)
+            return self._mirror_order
+
+    def _open_url(self, url: str, headers: "dict[str, str]") -> "Any":
+        """
+        Issue a GET request, returning the response.
+
+        Plain HTTP(S) requests use keep-alive connections from a pool shared
+        within the process. "file:" URLs are read directly. Other URLs, and
+        hosts that need a proxy, go through urlopen().
+
+        Unlike urlopen(), a "304 Not Modified" is returned as a response.
+        """
+        import urllib.request
+
+        with trace_span("request", url=url) as span:
+            if url.startswith("file:"):
+                resp = _open_file_url(url, headers)
+            elif not _can_pool(url):
+                req = urllib.request.Request(url, headers=headers)
+                try:
+                    resp = urllib.request.urlopen(
+                        req, context=_ssl_context(), timeout=HTTP_TIMEOUT
+                    )
+                except urllib.error.HTTPError as e:
+                    if e.code != 304:
+                        raise _http_error(url, e.code, e.reason) from e
+                    resp = e
+            else:
+                resp = _HTTP_POOL.get(url, headers)
+                if resp.status >= 300 and resp.status != 304:
+                    resp.close()
+                    raise _http_error(url, resp.status, resp.reason)
+            span["status"] = resp.status
+        return resp
+
+    def _download_range(
+        self,
+        url: str,
+        resp: "Any",
+        of: "IO[bytes]",
+        end: "int | None",
+        etag: "str | None",
+        hasher: "Any" = None,
+    ) -> None:
+        """
+        Write the body of 'resp' into 'of' at its current position, up to the
+        offset 'end'. If the transfer is interrupted, continue it with "Range"
+        requests. The written data is also fed into 'hasher', if given.
+        """
+        import http.client
+
+        attempt = 0
+        while True:
+            try:
+                with resp:
+                    limit = None if end is None else end - of.tell()
+                    _copy_response(resp, of, limit, hasher)
+                if end is None or of.tell() >= end:
+                    return
+                raise http.client.IncompleteRead(b"", end - of.tell())
+            except (OSError, http.client.HTTPException) as e:
+                if not etag or attempt >= DOWNLOAD_RESUME_ATTEMPTS:
+                    raise
+                attempt += 1
+                LOGGER.warning(
+                    "Download of %s interrupted at %d bytes (%r), resuming",
+                    url,
+                    of.tell(),
+                    e,
+                )
+                range_end = "" if end is None else str(end - 1)
+                resp = self._open_url(
+                    url, {"Range": f"bytes={of.tell()}-{range_end}", "If-Range": etag}
+                )
+                if resp.status != 206:
+                    resp.close()
+                    raise RuntimeError(
+                        f"The file changed while downloading [{url}]"
+                    ) from e
+
+    def _download_parts(
+        self, url: str, resp: "Any", part: Path, size: int, etag: str
+    ) -> None:
+        """
+        Download 'size' bytes into 'part' as several byte ranges in parallel.
+
+        The first range is read from the already-open response 'resp'.
+        """
+        n_parts = self.download_parts
+        LOGGER.info("Downloading %s in %d parts", url, n_parts)
+        bounds = [size * i // n_parts for i in range(n_parts + 1)]
+        with part.open("wb") as of:
+            of.truncate(size)
+
+        def fetch(idx: int) -> None:
+            start, end = bounds[idx], bounds[idx + 1]
+            seg_resp = resp
+            if idx != 0:
+                seg_resp = self._open_url(
+                    url, {"Range": f"bytes={start}-{end - 1}", "If-Range": etag}
+                )
+                if seg_resp.status != 206:
+                    seg_resp.close()
+                    raise RuntimeError(f"The file changed while downloading [{url}]")
+            with part.open("r+b") as of:
+                of.seek(start)
+                self._download_range(url, seg_resp, of, end, etag)
+
+        with ThreadPoolExecutor(max_workers=n_parts) as pool:
+            futures = [pool.submit(fetch, i) for i in range(n_parts)]
+        for fut in futures:
+            fut.result()
 
     def refresh_full_json(self) -> None:
         """
@@ -653,12 +2092,36 @@ class Cache:
         """
         default_source = "https://downloads.mongodb.org/full.json"
         download_source = os.environ.get("MONGODB_DOWNLOAD_SOURCE", default_source)
-        with self._db.transaction():
-            dl = self.download_file(download_source)
-            if not dl.is_changed:
-                # We still have a good cache
-                return
-            self._db.import_json_file(dl.path)
+        if self.offline:
+            if not self._db.has_versions():
+                raise RuntimeError(
+                    "The cache has no download list, and we are offline. "
+                    "Import a bundle with --import-bundle first."
+                )
+            return
+        # Only one process needs to fetch and import a new list. The others
+        # wait for it, and then use the list that it imported.
+        with trace_span("refresh_full_json", url=download_source):
+            started = time.time()
+            with self._locked("full-json") as waited:
+                if (
+                    waited
+                    and self.fetched_since(download_source, started)
+                    and self._db.has_versions()
+                ):
+                    return
+                dl = self.download_file(
+                    download_source, ttl=self.full_json_ttl, default_ttl=FULL_JSON_TTL
+                )
+                if not dl.is_changed and self._db.has_versions():
+                    # We still have a good cache
+                    return
+                try:
+                    self._db.import_json_file(dl.path)
+                except BaseException:
+                    # Make sure that the next run imports the list again
+                    self.discard_file(download_source)
+                    raise
 
 
 def _mkdir(dirpath: Path) -> None:
@@ -679,6 +2142,379 @@ def _mkdir(dirpath: Path) -> None:
         pass
 
 
+@contextmanager
+def _file_lock(path: Path) -> "Iterator[bool]":
+    """
+    Hold an exclusive advisory lock on the file at 'path' (which is created
+    if needed) for the duration of the context.
+
+    The lock is held through a fresh file descriptor, so it excludes other
+    threads of this process as well as other processes. Yields whether the
+    lock was busy and had to be waited on.
+    """
+    _mkdir(path.parent)
+    with path.open("a+b") as f:
+        waited = not _lock_fd(f.fileno(), blocking=False)
+        if waited:
+            LOGGER.debug("Waiting for lock %s", path)
+            _lock_fd(f.fileno(), blocking=True)
+        try:
+            yield waited
+        finally:
+            if sys.platform == "win32":
+                os.lseek(f.fileno(), 0, os.SEEK_SET)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _lock_fd(fd: int, blocking: bool) -> bool:
+    """
+    Lock the open file 'fd'. Returns False if it is busy and not 'blocking'.
+    """
+    while True:
+        try:
+            if sys.platform == "win32":
+                # msvcrt locks a byte range from the current position
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+                fcntl.flock(fd, flags)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            if sys.platform != "win32":
+                raise
+            # LK_LOCK only retries for a few seconds, so poll instead
+            time.sleep(0.1)
+
+
+def _tree_size(root: Path, unshared: bool = False) -> int:
+    """
+    Get the total size of the files within the directory 'root'. If
+    'unshared', only count the files that have no other hard links.
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(str(root)):
+        for fname in filenames:
+            st = os.lstat(os.path.join(dirpath, fname))
+            if not unshared or st.st_nlink == 1:
+                total += st.st_size
+    return total
+
+
+def _tree_fingerprint(root: Path) -> str:
+    """
+    Get a digest of the names, sizes, modes and modification times of the files
+    within the directory 'root'. Writing to one of the files changes it.
+    """
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(str(root)):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            path = os.path.join(dirpath, fname)
+            st = os.lstat(path)
+            rel = os.path.relpath(path, str(root))
+            h.update(f"{rel}\0{st.st_size}\0{st.st_mode}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def _parse_size(text: str) -> int:
+    """
+    Parse a byte count with an optional binary unit, e.g. "512M" or "20GiB".
+    """
+    mat = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", text, re.IGNORECASE
+    )
+    if not mat:
+        raise argparse.ArgumentTypeError(f"Invalid size: {text!r}")
+    return int(float(mat[1]) * 1024 ** " KMGT".index(mat[2].upper() or " "))
+
+
+def _link_tree(src: Path, dest: Path) -> None:
+    """
+    Recreate the directory tree 'src' within 'dest', with hard links to the
+    files of 'src' where possible and with copies otherwise.
+    """
+    can_link = True
+    for dirpath, _, filenames in os.walk(str(src)):
+        out_dir = dest / Path(dirpath).relative_to(src)
+        _mkdir(out_dir)
+        for fname in filenames:
+            target = out_dir / fname
+            _unlink_existing(target)
+            if can_link:
+                try:
+                    os.link(os.path.join(dirpath, fname), str(target))
+                    continue
+                except OSError:
+                    # E.g. a different filesystem, or no support for links.
+                    can_link = False
+            shutil.copy2(os.path.join(dirpath, fname), str(target))
+
+
+def _unlink_existing(path: Path) -> None:
+    """
+    Remove the file at 'path', if any, before a new one is written there.
+
+    Files in an output directory may be hard links into the extraction cache
+    (see _link_tree()), so they must never be written to in place.
+    """
+    if path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def _env_mirrors() -> "list[str]":
+    """
+    Get the mirrors listed in the comma-separated MONGODL_MIRRORS environment
+    variable.
+    """
+    items = os.environ.get("MONGODL_MIRRORS", "").split(",")
+    return [_mirror_base(item.strip()) for item in items if item.strip()]
+
+
+def _mirror_base(mirror: str) -> str:
+    """
+    Normalize a mirror given as a URL or as a local directory to a base URL.
+    """
+    if "://" in mirror:
+        return mirror.rstrip("/")
+    return Path(mirror).resolve().as_uri()
+
+
+def _mirror_sources(mirrors: "Iterable[str]", url: str) -> "list[str]":
+    """
+    Get the URLs of the file at 'url' on each of the 'mirrors'.
+
+    A mirror holds the files of each host in a directory named after the host,
+    so "https://downloads.mongodb.org/full.json" is expected at
+    "<mirror>/downloads.mongodb.org/full.json".
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return []
+    path = parts.netloc + parts.path
+    if parts.query:
+        path += "?" + parts.query
+    return [f"{mirror}/{path}" for mirror in mirrors]
+
+
+def _rank_mirrors(mirrors: "list[str]") -> "list[str]":
+    """
+    Probe the given mirrors concurrently, returning those that respond,
+    ordered by latency. Mirrors that respond equally fast keep their order.
+    """
+    if not mirrors:
+        return []
+    with ThreadPoolExecutor(max_workers=len(mirrors)) as pool:
+        latencies = list(pool.map(_probe_mirror, mirrors))
+    ranked = sorted(
+        (lat, idx, mirror)
+        for idx, (lat, mirror) in enumerate(zip(latencies, mirrors))
+        if lat is not None
+    )
+    for lat, _, mirror in ranked:
+        LOGGER.info("Using mirror %s (%.0f ms)", mirror, lat * 1000)
+    for lat, mirror in zip(latencies, mirrors):
+        if lat is None:
+            LOGGER.warning("Mirror %s is not reachable", mirror)
+    return [mirror for _, _, mirror in ranked]
+
+
+def _probe_mirror(mirror: str) -> "float | None":
+    """
+    Measure the time taken to connect to 'mirror', or return None if it cannot
+    be reached. A local directory takes no time.
+    """
+    import socket
+    import urllib.request
+
+    parts = urllib.parse.urlsplit(mirror)
+    if parts.scheme == "file":
+        path = Path(urllib.request.url2pathname(parts.path))
+        return 0.0 if path.is_dir() else None
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    start = time.perf_counter()
+    try:
+        with socket.create_connection(
+            (parts.hostname, port), timeout=MIRROR_PROBE_TIMEOUT
+        ):
+            return time.perf_counter() - start
+    except OSError:
+        return None
+
+
+def _open_file_url(url: str, headers: "dict[str, str]") -> "Any":
+    """
+    Open a "file:" URL as a response, like urlopen() does. Unlike urlopen(),
+    an "If-Modified-Since" header is honored with a "304 Not Modified".
+    """
+    import email.message
+    import email.utils
+    import urllib.request
+    import urllib.response
+
+    path = Path(urllib.request.url2pathname(urllib.parse.urlsplit(url).path))
+    if not path.is_file():
+        raise PermanentDownloadError(f"Failed to download [{url}]: No such file")
+    stat = path.stat()
+    msg = email.message.Message()
+    msg["Content-Length"] = str(stat.st_size)
+    msg["Last-Modified"] = email.utils.formatdate(stat.st_mtime, usegmt=True)
+    since = headers.get("If-Modified-Since")
+    if since and int(stat.st_mtime) <= email.utils.mktime_tz(
+        email.utils.parsedate_tz(since) or (0,) * 10
+    ):
+        return urllib.response.addinfourl(io.BytesIO(), msg, url, 304)
+    return urllib.response.addinfourl(path.open("rb"), msg, url, 200)
+
+
+def _http_error(url: str, status: int, reason: str) -> RuntimeError:
+    """
+    Create the error for a failed request. Client errors are permanent, except
+    for timeouts and rate limiting.
+    """
+    msg = f"Failed to download [{url}]: HTTP {status} {reason}"
+    if 400 <= status < 500 and status not in (408, 429):
+        return PermanentDownloadError(msg)
+    return RuntimeError(msg)
+
+
+def _can_pool(url: str) -> bool:
+    """
+    Whether 'url' can be requested through _HTTP_POOL: plain HTTP(S), without
+    a proxy configured for it.
+    """
+    import urllib.request
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return False
+    if parts.scheme not in urllib.request.getproxies():
+        return True
+    return bool(urllib.request.proxy_bypass(parts.hostname or ""))
+
+
+def _extractfile(tf: "tarfile.TarFile", name: str) -> "IO[bytes]":
+    """
+    Open the regular file member 'name' of the tar file 'tf'.
+    """
+    f = tf.extractfile(name)
+    if f is None:
+        raise RuntimeError(f"[{name}] is not a regular file")
+    return f
+
+
+def _response_total_size(resp: "Any") -> "int | None":
+    """
+    Get the full size of the file being sent in the HTTP response 'resp'.
+    """
+    if resp.status == 206:
+        # Content-Range: bytes <first>-<last>/<total>
+        total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = resp.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+
+def _response_expiry(resp: "Any") -> "float | None":
+    """
+    Get the time until which the file sent in 'resp' may be used without
+    revalidating it, according to its "Cache-Control" header. Returns None if
+    the server did not specify that.
+    """
+    directives = {}  # type: dict[str, str]
+    for item in resp.headers.get("Cache-Control", "").split(","):
+        name, _, value = item.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+    if "no-cache" in directives or "no-store" in directives:
+        return 0.0
+    max_age = directives.get("max-age", "")
+    if not max_age.isdigit():
+        return None
+    age = resp.headers.get("Age", "")
+    return time.time() + int(max_age) - (int(age) if age.isdigit() else 0)
+
+
+def _copy_response(
+    resp: "IO[bytes]",
+    of: "IO[bytes] | None",
+    limit: "int | None",
+    hasher: "Any" = None,
+) -> None:
+    """
+    Copy the body of 'resp' into 'of', stopping after 'limit' bytes if given.
+    The data is also fed into 'hasher', if given.
+    """
+    while limit is None or limit > 0:
+        size = DOWNLOAD_CHUNK_SIZE if limit is None else min(limit, DOWNLOAD_CHUNK_SIZE)
+        data = resp.read(size)
+        if not data:
+            return
+        if hasher is not None:
+            hasher.update(data)
+        if of is not None:
+            of.write(data)
+        if limit is not None:
+            limit -= len(data)
+
+
+def _iter_json_array(fp: "IO[str]", key: str) -> "Iterator[Any]":
+    """
+    Lazily decode the items of the array named 'key' in the JSON file 'fp'.
+
+    Only one item is decoded at a time. This assumes that the first occurrence
+    of '"<key>": [' in the file is the array in question, which holds for the
+    documents that we read.
+    """
+    decoder = json.JSONDecoder()
+    start_re = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    ws_re = re.compile(r"[\s,]*")
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> None:
+        nonlocal buf, pos, eof
+        chunk = fp.read(DOWNLOAD_CHUNK_SIZE)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        mat = start_re.search(buf)
+        if mat:
+            pos = mat.end()
+            break
+        if eof:
+            raise ValueError(f'No "{key}" array was found in the JSON document')
+        # Keep a tail in case the key is split across chunks
+        pos = max(0, len(buf) - len(key) - 64)
+        fill()
+
+    while True:
+        pos = ws_re.match(buf, pos).end()  # type: ignore
+        if pos == len(buf):
+            if eof:
+                raise ValueError(f'The "{key}" array is truncated')
+            fill()
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The item continues in the next chunk
+            fill()
+            continue
+        yield item
+        pos = end
+
+
 def _print_list(
     db: CacheDB,
     version: "str | None",
@@ -687,6 +2523,8 @@ def _print_list(
     edition: "str | None",
     component: "str | None",
 ):
+    import textwrap
+
     if version or target or arch or edition or component:
         counter = 0
         matching = db.iter_available(
@@ -724,7 +2562,7 @@ def _print_list(
             (select group_concat(edition, ', ') from (select distinct edition from mdl_downloads)),
             (select group_concat(version, ', ') from (
                 select distinct version from mdl_versions
-                ORDER BY version COLLATE mdb_version)),
+                ORDER BY version_key)),
             (select group_concat(key, ', ') from (select distinct key from mdl_components))
         )
         """)
@@ -781,7 +2619,12 @@ def _published_build_url(
         component = "archive"
         value = "debug_symbols"
     matching = cache.db.iter_available(
-        version=version, target=target, arch=arch, edition=edition, component=component
+        version=version,
+        target=target,
+        arch=arch,
+        edition=edition,
+        component=component,
+        limit=1,
     )
     tup = next(iter(matching), None)
     if tup is None:
@@ -837,14 +2680,7 @@ def _latest_build_url(
     # Enterprise builds have an "enterprise" infix
     ent_infix = "enterprise-" if edition == "enterprise" else ""
     if "rhel" in target:
-        # Some RHEL targets include a minor version, like "rhel93". Check the URL of the latest release.
-        latest_release_url, _ = _published_build_url(
-            cache, "latest-release", target, arch, edition, component
-        )
-        got = re.search(r"rhel[0-9][0-9]", latest_release_url)
-        if got is not None:
-            # Rewrite target like "rhel9" to "rhel93" to match published URL.
-            target = got.group(0)
+        target = _rhel_minor_target(cache, target, arch, edition, component)
     # Some platforms have a filename infix
     tgt_infix = (target + "-") if target not in ("windows", "win32", "macos") else ""
     # Non-master branch uses a filename infix
@@ -855,87 +2691,478 @@ def _latest_build_url(
     return f"{base}/{filename}"
 
 
-def _dl_component(
+def _rhel_minor_target(
+    cache: Cache, target: str, arch: str, edition: str, component: str
+) -> str:
+    """
+    Some RHEL targets include a minor version, like "rhel93". Get the target
+    that is used in the URL of the latest release, e.g. "rhel93" for "rhel9".
+
+    The result is remembered until the download list changes.
+    """
+    key = f"rhel-target:{target}:{arch}:{edition}:{component}"
+    found = cache.db.memo_get(key)
+    if found is None:
+        latest_release_url, _ = _published_build_url(
+            cache, "latest-release", target, arch, edition, component
+        )
+        got = re.search(r"rhel[0-9][0-9]", latest_release_url)
+        found = target if got is None else got.group(0)
+        cache.db.memo_set(key, found, from_downloads=True)
+    return found
+
+
+def _resolve_component(
     cache: Cache,
-    out_dir: Path,
     version: str,
     target: str,
     arch: str,
     edition: str,
     component: str,
-    pattern: "str | None",
-    strip_components: int,
-    test: bool,
-    no_download: bool,
     latest_build_branch: "str|None",
-    retries: int,
-) -> ExpandResult:
-    LOGGER.info(f"Download {component} {version}-{edition} for {target}-{arch}")
+) -> "tuple[str, str | None]":
+    """
+    Get the download URL and the expected SHA-256 (if known) of a component.
+    """
     if version in ("latest-build", "latest"):
         dl_url = _latest_build_url(
             cache, target, arch, edition, component, latest_build_branch
         )
-        sha256 = None
-    else:
-        try:
-            dl_url, sha256 = _published_build_url(
-                cache, version, target, arch, edition, component
-            )
-        except ValueError:
-            if component == "crypt_shared" and version != "latest-release":
-                warnings.warn(
-                    "No matching version of crypt_shared found, using 'latest-release'",
-                    stacklevel=2,
-                )
-                version = "latest-release"
-                # The target will be macos on latest-release.
-                if target == "osx":
-                    target = "macos"
-            else:
-                raise
-            dl_url, sha256 = _published_build_url(
-                cache, version, target, arch, edition, component
+        return dl_url, None
+    try:
+        return _published_build_url(cache, version, target, arch, edition, component)
+    except ValueError:
+        if component == "crypt_shared" and version != "latest-release":
+            warnings.warn(
+                "No matching version of crypt_shared found, using 'latest-release'",
+                stacklevel=2,
             )
+            version = "latest-release"
+            # The target will be macos on latest-release.
+            if target == "osx":
+                target = "macos"
+        else:
+            raise
+        return _published_build_url(cache, version, target, arch, edition, component)
 
-    # This must go to stdout to be consumed by the calling program.
-    print(dl_url)
 
-    LOGGER.info("Download url: %s", dl_url)
+def _fetch_component(
+    cache: Cache,
+    dl_url: str,
+    sha256: "str | None",
+    out_dir: Path,
+    pattern: "str | None",
+    strip_components: int,
+    test: bool,
+    retries: int,
+    after: "threading.Event | None" = None,
+) -> ExpandResult:
+    """
+    Download, verify, and extract a resolved component, retrying on failure.
 
-    if no_download:
-        return None
+    Only the failed stage is retried: if the extraction fails, the downloaded
+    file is extracted again, unless the archive itself turned out to be bad.
+    If 'after' is given, the extraction waits until that event is set (but the
+    download does not).
+    """
+    import tarfile
+    import zipfile
+    import zlib
 
-    retrier = DownloadRetrier(retries)
+    policy = RetryPolicy(retries)
+    dl = None  # type: DownloadResult | None
     while True:
         try:
-            cached = cache.download_file(dl_url).path
-            if sha256 is not None and not _check_shasum256(cached, sha256):
-                raise ValueError("Incorrect shasum256 for %s", cached)
-            return _expand_archive(
-                cached, out_dir, pattern, strip_components, test=test
+            if dl is None:
+                dl = _download_verified(cache, dl_url, sha256)
+            if after is not None:
+                after.wait()
+            return cache.expand_archive(
+                dl.path, dl.sha256, out_dir, pattern, strip_components, test=test
             )
         except Exception as e:
             LOGGER.exception(e)
-            if not retrier.retry():
+            if dl is not None and isinstance(
+                e, (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error)
+            ):
+                # Don't let the next attempt reuse the bad archive
+                cache.discard_file(dl_url)
+                dl = None
+            if not policy.retry(e):
                 raise
 
 
-def _check_shasum256(filename, shasum):
-    """Check if the file with the name "filename" matches the SHA-256 sum
-    in "shasum"."""
-    h = hashlib.sha256()
-    # This will raise an exception if the file doesn't exist. Catching
-    # and handling it is left as an exercise for the reader.
-    with open(filename, "rb") as fh:
-        # Read and hash the file in 4K chunks. Reading the whole
-        # file at once might consume a lot of memory if it is
-        # large.
+def _download_verified(
+    cache: Cache, dl_url: str, sha256: "str | None"
+) -> DownloadResult:
+    """
+    Download a resolved component, checking it against its expected SHA-256.
+    """
+    dl = cache.download_file(dl_url)
+    if sha256 is not None and dl.sha256 != sha256:
+        # Don't let the next attempt reuse the bad file
+        cache.discard_file(dl_url)
+        raise ValueError("Incorrect shasum256 for %s", dl.path)
+    return dl
+
+
+def component_request(
+    component: "str | None" = None,
+    *,
+    version: "str | None" = None,
+    target: "str | None" = None,
+    arch: "str | None" = None,
+    edition: "str | None" = None,
+    out_dir: "Path | None" = None,
+    pattern: "str | None" = None,
+    strip_components: int = 0,
+    latest_build_branch: "str | None" = None,
+    cache: "Cache | None" = None,
+) -> ComponentRequest:
+    """
+    Create a ComponentRequest, filling in the same defaults as the command line.
+
+    If 'cache' is given, an inferred target is remembered in its database.
+    """
+    # Translate perf version if applicable:
+    if version in PERF_VERSIONS:
+        version = PERF_VERSIONS[version]
+    if version is None:
+        version = "latest-build"
+    if target is None or target == "auto":
+        target = infer_target(version) if cache is None else cache.infer_target(version)
+    if arch is None or arch == "auto":
+        arch = infer_arch()
+    return ComponentRequest(
+        component=component if component is not None else "archive",
+        version=version,
+        target=target,
+        arch=arch,
+        edition=edition if edition is not None else "enterprise",
+        out_dir=(out_dir or Path.cwd()).absolute(),
+        pattern=pattern,
+        strip_components=strip_components,
+        latest_build_branch=latest_build_branch,
+    )
+
+
+def _resolve_requests(
+    cache: Cache, requests: "Iterable[ComponentRequest]"
+) -> "list[tuple[ComponentRequest, str | None, str | None, ValueError | None]]":
+    """
+    Get the download URL and the expected SHA-256 (if known) of each of several
+    components. A request that matches no download gets the ValueError that
+    says so instead.
+    """
+    resolved = []  # type: list[tuple[ComponentRequest, str | None, str | None, ValueError | None]]
+    for req in requests:
+        with trace_span(
+            "resolve", component=req.component, version=req.version
+        ) as span:
+            try:
+                dl_url, sha256 = _resolve_component(
+                    cache,
+                    req.version,
+                    req.target,
+                    req.arch,
+                    req.edition,
+                    req.component,
+                    req.latest_build_branch,
+                )
+            except ValueError as e:
+                resolved.append((req, None, None, e))
+                continue
+            span["url"] = dl_url
+        resolved.append((req, dl_url, sha256, None))
+    return resolved
+
+
+def _map_concurrently(
+    fn: "Callable[[Any], Any]", items: "list[Any]", jobs: "int | None"
+) -> "list[Any]":
+    """
+    Call 'fn' on each of 'items' on a pool of at most 'jobs' threads (Default is
+    DEFAULT_JOBS), starting them in order. Returns the results in the same
+    order. If any call fails, the first error is raised once all of them are
+    finished.
+    """
+    if not items:
+        return []
+    jobs = min(jobs or DEFAULT_JOBS, len(items))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(fn, item) for item in items]
+    # Leaving the executor waits for every call, so all have finished here.
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        raise errors[0]
+    return [f.result() for f in futures]
+
+
+def download_components(
+    cache: Cache,
+    requests: "Iterable[ComponentRequest]",
+    *,
+    test: bool = False,
+    no_download: bool = False,
+    retries: int = 0,
+    jobs: "int | None" = None,
+) -> "list[ExpandResult | None]":
+    """
+    Download and extract several components concurrently.
+
+    All download URLs are resolved up front, then the components are downloaded
+    and extracted on a pool of at most ``jobs`` threads, each with its own
+    retries. Components with the same output directory are extracted one at a
+    time, in the order of ``requests``, since their files may overlap (like
+    those of the "archive" and the legacy "shell"). The results are returned in
+    the order of ``requests``. If any component fails, the first error is
+    raised once all of them are finished.
+    """
+    resolved = []  # type: list[tuple[ComponentRequest, str, str | None]]
+    for req, dl_url, sha256, error in _resolve_requests(cache, requests):
+        LOGGER.info(
+            f"Download {req.component} {req.version}-{req.edition} for {req.target}-{req.arch}"
+        )
+        if error is not None:
+            raise error
+        assert dl_url is not None
+        # This must go to stdout to be consumed by the calling program.
+        print(dl_url)
+        LOGGER.info("Download url: %s", dl_url)
+        resolved.append((req, dl_url, sha256))
+
+    if no_download:
+        return [None] * len(resolved)
+
+    # Each extraction waits for the one before it into the same directory. The
+    # pool starts its calls in order, so the one waited for has always started.
+    extracted = [threading.Event() for _ in resolved]
+    previous = {}  # type: dict[Path, threading.Event]
+    after = []  # type: list[threading.Event | None]
+    for (req, _, _), event in zip(resolved, extracted):
+        after.append(previous.get(req.out_dir))
+        previous[req.out_dir] = event
+
+    def fetch(idx: int) -> ExpandResult:
+        req, dl_url, sha256 = resolved[idx]
+        try:
+            return _fetch_component(
+                cache,
+                dl_url,
+                sha256,
+                req.out_dir,
+                req.pattern,
+                req.strip_components,
+                test,
+                retries,
+                after[idx],
+            )
+        finally:
+            extracted[idx].set()
+
+    return _map_concurrently(fetch, list(range(len(resolved))), jobs)
+
+
+def resolve_components(
+    cache: Cache, requests: "Iterable[ComponentRequest]"
+) -> "list[dict[str, Any]]":
+    """
+    Get the download URL and expected SHA-256 of each of several components,
+    without downloading anything.
+
+    Each result is a dict with the fields of the request, plus "url" and
+    "sha256", or an "error" message if there is no matching download.
+    """
+    results = []
+    for req, dl_url, sha256, error in _resolve_requests(cache, requests):
+        item = {
+            "component": req.component,
+            "version": req.version,
+            "target": req.target,
+            "arch": req.arch,
+            "edition": req.edition,
+            "latest_build_branch": req.latest_build_branch,
+        }  # type: dict[str, Any]
+        if error is None:
+            item["url"], item["sha256"] = dl_url, sha256
+        else:
+            item["error"] = str(error)
+        results.append(item)
+    return results
+
+
+_BATCH_KEYS = (
+    "component",
+    "version",
+    "target",
+    "arch",
+    "edition",
+    "latest_build_branch",
+)
+
+
+def _batch_request(cache: Cache, entry: Any) -> ComponentRequest:
+    """
+    Create the ComponentRequest for an entry of a "--resolve-batch" file.
+    Raises ValueError if the entry is malformed.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError(f"Expected an object, got {json.dumps(entry)}")
+    unknown = sorted(set(entry) - set(_BATCH_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown keys: {', '.join(unknown)}")
+    for key, value in entry.items():
+        if value is not None and not (isinstance(value, str) and value):
+            raise ValueError(
+                f'"{key}" must be a non-empty string, got {json.dumps(value)}'
+            )
+    return component_request(
+        entry.get("component"),
+        version=entry.get("version"),
+        target=entry.get("target"),
+        arch=entry.get("arch"),
+        edition=entry.get("edition"),
+        latest_build_branch=entry.get("latest_build_branch"),
+        cache=cache,
+    )
+
+
+def _resolve_batch(cache: Cache, entries: "list[Any]") -> "list[dict[str, Any]]":
+    """
+    Resolve the entries of a "--resolve-batch" file like resolve_components().
+    A malformed entry gets an "error" result of its own (along with the entry
+    as it was given) instead of failing the whole batch.
+    """
+    results = [None] * len(entries)  # type: list[dict[str, Any] | None]
+    requests = []  # type: list[ComponentRequest]
+    indices = []  # type: list[int]
+    for i, entry in enumerate(entries):
+        try:
+            requests.append(_batch_request(cache, entry))
+        except ValueError as e:
+            results[i] = {"entry": entry, "error": str(e)}
+        else:
+            indices.append(i)
+    for i, item in zip(indices, resolve_components(cache, requests)):
+        results[i] = item
+    return [item for item in results if item is not None]
+
+
+def install_key(
+    cache: Cache, requests: "Iterable[ComponentRequest]", dest: Path
+) -> "list[dict[str, Any]] | None":
+    """
+    Describe the tree that the given components make when they are extracted
+    into 'dest', as a key for Cache.install_tree(). Their output directories
+    must be within 'dest'.
+
+    A component without a published checksum (like the "latest-build"
+    archives) is described by the SHA-256 of its cached copy, if that was
+    fetched or revalidated within the last "full_json_ttl" seconds of the
+    cache (or FULL_JSON_TTL). Otherwise its content is not known in
+    advance, and None is returned.
+    """
+    requests = list(requests)
+    resolved = resolve_components(cache, requests)
+    key = []
+    for req, item in zip(requests, resolved):
+        sha256 = item.get("sha256")
+        if sha256 is None and "url" in item:
+            window = cache.full_json_ttl
+            if window is None:
+                window = FULL_JSON_TTL
+            dl = cache.fetched_since(item["url"], time.time() - window)
+            sha256 = dl.sha256 if dl is not None else None
+        if sha256 is None:
+            return None
+        key.append(
+            {
+                "url": item["url"],
+                "sha256": sha256,
+                "out": req.out_dir.absolute().relative_to(dest.absolute()).as_posix(),
+                "pattern": req.pattern,
+                "strip_components": req.strip_components,
+            }
+        )
+    return key
+
+
+def warm_cache(
+    cache: Cache,
+    requests: "Iterable[ComponentRequest]",
+    *,
+    retries: int = 0,
+    jobs: "int | None" = None,
+) -> "dict[str, DownloadResult]":
+    """
+    Download and verify the archives of several components into the cache,
+    without extracting them, so that later downloads need no network access.
+    Returns the results by URL.
+
+    Requests that match no available build are skipped with a warning. Each
+    distinct file is downloaded once, on a pool of at most ``jobs`` threads.
+    If any download fails, the first error is raised once all are finished.
+    """
+    resolved = {}  # type: dict[str, str | None]
+    for req, dl_url, sha256, error in _resolve_requests(cache, requests):
+        if error is not None:
+            LOGGER.warning(
+                f"Skipping {req.component} {req.version}-{req.edition} "
+                f"for {req.target}-{req.arch}: {error}"
+            )
+            continue
+        assert dl_url is not None
+        LOGGER.debug("Warm url: %s", dl_url)
+        resolved[dl_url] = sha256
+    if not resolved:
+        return {}
+
+    def fetch(dl_url: str) -> DownloadResult:
+        policy = RetryPolicy(retries)
         while True:
-            data = fh.read(4096)
-            if len(data) == 0:
-                break
-            h.update(data)
-    return shasum == h.hexdigest()
+            try:
+                return _download_verified(cache, dl_url, resolved[dl_url])
+            except Exception as e:
+                LOGGER.exception(e)
+                if not policy.retry(e):
+                    raise
+
+    results = dict(zip(resolved, _map_concurrently(fetch, list(resolved), jobs)))
+    size = sum(dl.path.stat().st_size for dl in results.values())
+    LOGGER.info("Cached %d files (%.1f MiB)", len(results), size / 1024**2)
+    return results
+
+
+def _json_roundtrip(value: "Any") -> "Any":
+    """
+    Get 'value' as it would be read back after writing it as JSON.
+    """
+    return json.loads(json.dumps(value))
+
+
+def _read_install_marker(tree: Path) -> "Any":
+    """
+    Get the key recorded by Cache.install_tree() in 'tree', or None.
+    """
+    try:
+        return json.loads((tree / INSTALL_MARKER).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _file_sha256(filename: Path) -> str:
+    """
+    Compute the SHA-256 of the file with the name "filename".
+    """
+    h = hashlib.sha256()
+    with trace_span("checksum", file=str(filename)) as span:
+        with open(filename, "rb") as fh:
+            # Read and hash the file in chunks. Reading the whole
+            # file at once might consume a lot of memory if it is
+            # large.
+            _copy_response(fh, None, None, h)
+            span["bytes"] = fh.tell()
+    return h.hexdigest()
 
 
 def _pathjoin(items: "Iterable[str]") -> PurePath:
@@ -945,36 +3172,79 @@ def _pathjoin(items: "Iterable[str]") -> PurePath:
     return PurePath("/".join(items))
 
 
-def _test_pattern(path: PurePath, pattern: "PurePath | None") -> bool:
+def _has_wildcards(pattern: str) -> bool:
     """
-    Test whether the given 'path' string matches the globbing pattern 'pattern'.
+    Whether the globbing pattern 'pattern' contains any wildcards.
+    """
+    return any(c in pattern for c in "*?[")
+
 
-    Supports the '**' pattern to match any number of intermediate directories.
+def _compile_pattern(pattern: "str | None") -> "re.Pattern[str] | None":
     """
-    if pattern is None:
-        return True
-    # Split pattern into parts
-    pattern_parts = pattern.parts
-    if not pattern_parts:
+    Compile the globbing pattern 'pattern' into a regular expression, or None
+    if the pattern matches every path.
+
+    The expression matches a path that is given with a leading slash before
+    each component, as in "/bin/mongod". Each pattern component is matched
+    like fnmatch() against one path component, and the '**' component matches
+    any number of intermediate directories. A path also matches if a leading
+    part of it matches (so a directory pattern matches its whole subtree).
+    """
+    parts = PurePath(pattern).parts if pattern else ()
+    if not parts:
         # An empty pattern always matches
-        return True
-    path_parts = path.parts
-    if not path_parts:
-        # Non-empty pattern requires more path components
-        return False
-    pattern_head = pattern_parts[0]
-    pattern_tail = _pathjoin(pattern_parts[1:])
-    if pattern_head == "**":
-        # Special "**" pattern matches any suffix of the path
-        # Generate each suffix:
-        tails = (path_parts[i:] for i in range(len(path_parts)))
-        # Test if any of the suffixes match the remainder of the pattern:
-        return any(_test_pattern(_pathjoin(t), pattern_tail) for t in tails)
-    if not fnmatch(path.parts[0], pattern_head):
-        # Leading path component cannot match
-        return False
-    # The first component matches. Test the remainder:
-    return _test_pattern(_pathjoin(path_parts[1:]), pattern_tail)
+        return None
+    expr = "(?:/.*)?"
+    # Build the expression from the last pattern component to the first:
+    for idx, part in reversed(list(enumerate(parts))):
+        if part != "**":
+            expr = "/" + _translate_glob(part) + expr
+        elif idx == len(parts) - 1:
+            # A trailing "**" matches any non-empty remainder
+            expr = "/.+"
+        else:
+            expr = "(?:/[^/]+)*" + expr
+    # fnmatch() normalizes the case of paths on case-insensitive systems
+    flags = re.DOTALL | (re.IGNORECASE if os.path.normcase("A") == "a" else 0)
+    return re.compile(f"{expr}\\Z", flags)
+
+
+def _translate_glob(part: str) -> str:
+    """
+    Translate a single fnmatch()-style path component into a regular
+    expression. Unlike fnmatch.translate(), wildcards never match a slash.
+    """
+    res = []
+    i, n = 0, len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == "*":
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and part[j] == "!":
+                j += 1
+            if j < n and part[j] == "]":
+                j += 1
+            while j < n and part[j] != "]":
+                j += 1
+            if j >= n:
+                # No closing bracket: Match a literal "["
+                res.append("\\[")
+                continue
+            stuff = part[i:j].replace("\\", "\\\\")
+            i = j + 1
+            if stuff[0] == "!":
+                stuff = "^" + stuff[1:]
+            elif stuff[0] in ("^", "["):
+                stuff = "\\" + stuff
+            res.append(f"[{stuff}]")
+        else:
+            res.append(re.escape(c))
+    return "".join(res)
 
 
 def _expand_archive(
@@ -986,12 +3256,34 @@ def _expand_archive(
     """
     LOGGER.debug(f"Extract from: [{ar.name}]")
     LOGGER.debug(f"        into: [{dest}]")
+    n_extracted = _expand_members(ar, dest, pattern, strip_components, test=test)
+    return _expand_result(n_extracted, pattern, strip_components, test=test)
+
+
+def _expand_members(
+    ar: Path, dest: Path, pattern: "str | None", strip_components: int, test: bool
+) -> int:
+    """
+    Expand the matching archive members from 'ar' into 'dest', returning the
+    number of members that were extracted.
+    """
     if ar.suffix == ".zip":
-        n_extracted = _expand_zip(ar, dest, pattern, strip_components, test=test)
+        expand = _expand_zip
     elif ar.suffix == ".tgz":
-        n_extracted = _expand_tgz(ar, dest, pattern, strip_components, test=test)
+        expand = _expand_tgz
     else:
         raise RuntimeError("Unknown archive file extension: " + ar.suffix)
+    with trace_span("extract", archive=ar.name, test=test) as span:
+        span["files"] = expand(ar, dest, pattern, strip_components, test=test)
+    return span["files"]
+
+
+def _expand_result(
+    n_extracted: int, pattern: "str | None", strip_components: int, test: bool
+) -> ExpandResult:
+    """
+    Report the number of extracted archive members.
+    """
     verb = "would be" if test else "were"
     if n_extracted == 0:
         if pattern and strip_components:
@@ -1022,86 +3314,157 @@ def _expand_archive(
 def _expand_tgz(
     ar: Path, dest: Path, pattern: "str | None", strip_components: int, test: bool
 ) -> int:
-    "Expand a tar.gz archive"
+    """
+    Expand a tar.gz archive
+
+    The members are read in a single pass as they are decompressed. If the
+    pattern names a single file, stop reading once that file was found.
+    """
+    import tarfile
+
     n_extracted = 0
+    matcher = _compile_pattern(pattern)
+    # A pattern without any wildcards matches one file (or one directory tree)
+    exact = PurePath(pattern) if pattern and not _has_wildcards(pattern) else None
     with tarfile.open(str(ar), "r:*") as tf:
-        for mem in tf.getmembers():
+        # Iterate lazily, instead of getmembers() which reads the whole archive
+        for mem in tf:
+            relpath = PurePath(mem.name)
             n_extracted += _maybe_extract_member(
                 dest,
-                PurePath(mem.name),
-                pattern,
+                relpath,
+                matcher,
                 strip_components,
                 mem.isdir(),
                 lambda: cast("IO[bytes]", tf.extractfile(mem)),  # noqa: B023
                 mem.mode | 0o222,  # make sure file is writable
                 test=test,
             )
+            if exact is not None and relpath == exact and not mem.isdir():
+                LOGGER.debug("Found the only file matching the pattern")
+                break
     return n_extracted
 
 
 def _expand_zip(
     ar: Path, dest: Path, pattern: "str | None", strip_components: int, test: bool
 ) -> int:
-    "Expand a .zip archive."
+    """
+    Expand a .zip archive.
+
+    Zip members are compressed independently, so the files are extracted on
+    several threads, each with its own handle on the archive.
+    """
+    import zipfile
+
     n_extracted = 0
+    matcher = _compile_pattern(pattern)
+    # Map each destination file to the last member that is extracted there,
+    # as with sequential extraction.
+    files = {}  # type: dict[Path, zipfile.ZipInfo]
     with zipfile.ZipFile(str(ar), "r") as zf:
         for item in zf.infolist():
-            n_extracted += _maybe_extract_member(
-                dest,
-                PurePath(item.filename),
-                pattern,
-                strip_components,
-                item.filename.endswith("/"),  ## Equivalent to: item.is_dir(),
-                lambda: zf.open(item, "r"),  # noqa: B023
-                0o777,
-                test=test,
-            )
+            is_dir = item.filename.endswith("/")  ## Equivalent to: item.is_dir(),
+            out = _member_dest(dest, PurePath(item.filename), matcher, strip_components)
+            if out is None:
+                continue
+            n_extracted += 1
+            if test:
+                continue
+            if is_dir:
+                _mkdir(out)
+            else:
+                files.pop(out, None)
+                files[out] = item
+    if not files:
+        return n_extracted
+
+    jobs = min(EXTRACT_JOBS, len(files))
+    work = list(files.items())
+
+    def extract(idx: int) -> None:
+        with zipfile.ZipFile(str(ar), "r") as zf:
+            for out, item in work[idx::jobs]:
+                _write_member(out, lambda: zf.open(item, "r"), 0o777)  # noqa: B023
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(extract, i) for i in range(jobs)]
+    for fut in futures:
+        fut.result()
     return n_extracted
 
 
-def _maybe_extract_member(
+def _member_dest(
     out: Path,
     relpath: PurePath,
-    pattern: "str | None",
+    matcher: "re.Pattern[str] | None",
     strip: int,
-    is_dir: bool,
-    opener: "Callable[[], IO[bytes]]",
-    modebits: int,
-    test: bool,
-) -> int:
+) -> "Path | None":
     """
-    Try to extract an archive member according to the given arguments.
-
-    :return: Zero if the file was excluded by filters, one otherwise.
+    Get the destination path of an archive member, or None if the member is
+    excluded by the filters. 'matcher' is a pattern from _compile_pattern().
     """
     relpath = PurePath(relpath)
     LOGGER.debug("  | {:-<65} |".format(str(relpath) + " "))
     if len(relpath.parts) <= strip:
         # Not enough path components
         LOGGER.debug(" (Excluded by --strip-components)")
-        return 0
-    if not _test_pattern(relpath, PurePath(pattern) if pattern else None):
+        return None
+    if matcher is not None and not matcher.match(
+        "".join("/" + part for part in relpath.parts)
+    ):
         # Doesn't match our pattern
         LOGGER.debug(" (excluded by pattern)")
-        return 0
+        return None
     stripped = _pathjoin(relpath.parts[strip:])
     dest = Path(out) / stripped
     LOGGER.debug(f"-> [{dest}]")
+    return dest
+
+
+def _write_member(dest: Path, opener: "Callable[[], IO[bytes]]", modebits: int) -> None:
+    """
+    Write the content of an archive member to the file 'dest'.
+    """
+    with opener() as infile:
+        _mkdir(dest.parent)
+        _unlink_existing(dest)
+        with dest.open("wb") as outfile:
+            shutil.copyfileobj(infile, outfile)
+        os.chmod(str(dest), modebits)
+
+
+def _maybe_extract_member(
+    out: Path,
+    relpath: PurePath,
+    matcher: "re.Pattern[str] | None",
+    strip: int,
+    is_dir: bool,
+    opener: "Callable[[], IO[bytes]]",
+    modebits: int,
+    test: bool,
+) -> int:
+    """
+    Try to extract an archive member according to the given arguments.
+    'matcher' is a pattern from _compile_pattern().
+
+    :return: Zero if the file was excluded by filters, one otherwise.
+    """
+    dest = _member_dest(out, relpath, matcher, strip)
+    if dest is None:
+        return 0
     if test:
         # We are running in test-only mode: Do not do anything
         return 1
     if is_dir:
         _mkdir(dest)
         return 1
-    with opener() as infile:
-        _mkdir(dest.parent)
-        with dest.open("wb") as outfile:
-            shutil.copyfileobj(infile, outfile)
-        os.chmod(str(dest), modebits)
+    _write_member(dest, opener, modebits)
     return 1
 
 
 def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -1111,6 +3474,89 @@ def main(argv=None):
         default=default_cache_dir(),
         help="Directory where download caches and metadata will be stored",
     )
+    parser.add_argument(
+        "--max-cache-size",
+        type=_parse_size,
+        default=os.environ.get("MONGODL_MAX_CACHE_SIZE"),
+        metavar="SIZE",
+        help="After downloading, remove the least recently used files from the "
+        'cache directory until it is at most SIZE large (e.g. "20G"). '
+        "Defaults to the MONGODL_MAX_CACHE_SIZE environment variable.",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help='Only prune the cache directory down to "--max-cache-size", then exit.',
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Download and verify the archives for every combination of the "
+        "comma-separated --version, --target, --arch, --edition, and --component "
+        "values into the cache directory, without extracting them.",
+    )
+    parser.add_argument(
+        "--resolve-batch",
+        type=Path,
+        metavar="FILE",
+        help="Only print the download URLs for a JSON array of requests read from "
+        'FILE (or "-" for stdin), as a JSON array. Each request is an object with '
+        'any of the keys "component", "version", "target", "arch", "edition", '
+        'and "latest_build_branch". A request that is malformed or has no '
+        'matching download gets an "error" message instead of a URL.',
+    )
+    parser.add_argument(
+        "--export-bundle",
+        type=Path,
+        metavar="FILE",
+        help='Like "--warm", then also write the downloaded files and their '
+        'download list entries into FILE, for use with "--import-bundle".',
+    )
+    parser.add_argument(
+        "--import-bundle",
+        type=Path,
+        metavar="FILE",
+        help='Only load a file written by "--export-bundle" into the cache '
+        "directory, then exit.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=None,
+        help="Never access the network. Only use the download list and files "
+        'that are already in the cache directory, e.g. from "--import-bundle". '
+        "Can also be enabled by setting MONGODL_OFFLINE=1.",
+    )
+    parser.add_argument(
+        "--full-json-ttl",
+        type=float,
+        default=os.environ.get("MONGODL_FULL_JSON_TTL"),
+        metavar="SECONDS",
+        help="Use a previously fetched download list for this many seconds "
+        "without checking for a newer one. Use 0 to always check. Defaults to "
+        "the MONGODL_FULL_JSON_TTL environment variable, or else the "
+        '"Cache-Control" lifetime sent by the server, or else '
+        f"{FULL_JSON_TTL}.",
+    )
+    parser.add_argument(
+        "--mirror",
+        action="append",
+        metavar="URL_OR_DIR",
+        help="A mirror to download files from. Give several times to use "
+        "the fastest reachable mirror, falling back to the next ones and to "
+        'the original URL. A file like "https://<host>/<path>" is expected at '
+        '"<mirror>/<host>/<path>". Defaults to the comma-separated '
+        "MONGODL_MIRRORS environment variable.",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=Path,
+        metavar="FILE",
+        help="Append the time taken by each stage of the work (refreshing and "
+        "importing the download list, resolving, connecting, transferring, "
+        "checksumming, and extracting) to FILE as JSON lines. Defaults to the "
+        "MONGODL_TRACE_FILE environment variable.",
+    )
     parser.add_argument(
         "--verbose", "-v", action="store_true", help="Whether to log at the DEBUG level"
     )
@@ -1168,7 +3614,9 @@ def main(argv=None):
         "--component",
         "-C",
         default=None,
-        help="The component to download. " 'Use "--list" to list available components.',
+        help="The component to download. Use a comma-separated list such as "
+        '"archive,crypt_shared" to download several components concurrently. '
+        'Use "--list" to list available components.',
     )
     dl_grp.add_argument(
         "--only",
@@ -1198,6 +3646,14 @@ def main(argv=None):
         action="store_true",
         help="Do not download the file, only print its url.",
     )
+    dl_grp.add_argument(
+        "--replace",
+        action="store_true",
+        help='Replace the "--out" directory as a whole. The components are '
+        "extracted into a staging directory next to it, which is then renamed "
+        'into place, keeping the previous directory as "<out>.prev". Nothing is '
+        'downloaded if "--out" already holds the same published components.',
+    )
     dl_grp.add_argument(
         "--test",
         action="store_true",
@@ -1217,6 +3673,28 @@ def main(argv=None):
         metavar="BRANCH_NAME",
     )
     dl_grp.add_argument("--retries", help="The number of times to retry", default=0)
+    dl_grp.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=DEFAULT_JOBS,
+        metavar="N",
+        help="The maximum number of components to download and extract at once "
+        f"(Default is {DEFAULT_JOBS})",
+    )
+    dl_grp.add_argument(
+        "--no-extract-cache",
+        action="store_true",
+        help="Extract directly from the archive, instead of reusing (and keeping) "
+        "an extracted copy in the cache directory.",
+    )
+    dl_grp.add_argument(
+        "--download-parts",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Download large files as N concurrent byte ranges (Default is 1)",
+    )
     args = parser.parse_args(argv)
 
     if args.verbose:
@@ -1224,50 +3702,141 @@ def main(argv=None):
     elif args.quiet:
         LOGGER.setLevel(logging.WARNING)
 
+    if args.trace_file:
+        set_trace_file(args.trace_file)
+
     cache = Cache.open_in(args.cache_dir)
+    cache.download_parts = args.download_parts
+    cache.extract_cache = not args.no_extract_cache
+    cache.max_size = args.max_cache_size
+    if args.offline:
+        cache.offline = True
+    if args.import_bundle:
+        cache.import_bundle(args.import_bundle)
+        return
+    if args.prune:
+        if cache.max_size is None:
+            parser.error('"--prune" requires "--max-cache-size"')
+        cache.prune(cache.max_size)
+        return
+
+    cache.full_json_ttl = args.full_json_ttl
+    if args.mirror:
+        cache.mirrors = [_mirror_base(mirror) for mirror in args.mirror]
     cache.refresh_full_json()
 
     version = args.version
     # Translate perf version if applicable:
     if version in PERF_VERSIONS:
         version = PERF_VERSIONS[version]
-    target = args.target
-    arch = args.arch
 
     if args.list:
-        _print_list(cache.db, version, target, arch, args.edition, args.component)
+        _print_list(
+            cache.db, version, args.target, args.arch, args.edition, args.component
+        )
         return
 
-    # Apply defaults:
-    if version is None:
-        version = "latest-build"
-    if target is None or target == "auto":
-        target = infer_target(version)
-    if arch is None or arch == "auto":
-        arch = infer_arch()
+    if args.resolve_batch:
+        if str(args.resolve_batch) == "-":
+            entries = json.load(sys.stdin)
+        else:
+            with args.resolve_batch.open("r", encoding="utf-8") as f:
+                entries = json.load(f)
+        if not isinstance(entries, list):
+            parser.error('"--resolve-batch" expects a JSON array of requests')
+        results = _resolve_batch(cache, entries)
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    if args.warm or args.export_bundle:
+        matrix = itertools.product(
+            *(
+                value.split(",") if value else [None]
+                for value in (
+                    args.component,
+                    args.version,
+                    args.target,
+                    args.arch,
+                    args.edition,
+                )
+            )
+        )
+        warmed = warm_cache(
+            cache,
+            (
+                component_request(
+                    component,
+                    version=version,
+                    target=target,
+                    arch=arch,
+                    edition=edition,
+                    latest_build_branch=args.latest_build_branch,
+                    cache=cache,
+                )
+                for component, version, target, arch, edition in matrix
+            ),
+            retries=int(args.retries),
+            jobs=args.jobs,
+        )
+        if args.export_bundle:
+            cache.export_bundle(args.export_bundle, warmed)
+        if cache.max_size is not None:
+            cache.prune(cache.max_size)
+        return
 
-    edition = args.edition if args.edition is not None else "enterprise"
-    component = args.component if args.component is not None else "archive"
+    components = (args.component or "archive").split(",")
+    requests = [
+        component_request(
+            component,
+            version=version,
+            target=args.target,
+            arch=args.arch,
+            edition=args.edition,
+            out_dir=args.out,
+            pattern=args.only,
+            strip_components=args.strip_components,
+            latest_build_branch=args.latest_build_branch,
+            cache=cache,
+        )
+        for component in components
+    ]
+    if args.replace:
+        if args.out is None or args.test or args.no_download:
+            parser.error(
+                '"--replace" requires "--out", and cannot be used with "--test" '
+                'or "--no-download"'
+            )
+        out = args.out.absolute()
 
-    out = args.out or Path.cwd()
-    out = out.absolute()
+        def describe() -> "list[dict[str, Any]] | None":
+            return install_key(cache, requests, out)
 
-    result = _dl_component(
-        cache,
-        out,
-        version=version,
-        target=target,
-        arch=arch,
-        edition=edition,
-        component=component,
-        pattern=args.only,
-        strip_components=args.strip_components,
-        test=args.test,
-        no_download=args.no_download,
-        latest_build_branch=args.latest_build_branch,
-        retries=int(args.retries),
-    )
-    if result is ExpandResult.Empty and args.empty_is_error:
+        with cache.install_tree(out, describe) as staging:
+            if staging is None:
+                # The calling program may still expect the URLs on stdout
+                for item in describe() or []:
+                    print(item["url"])
+                return
+            staged = [
+                req._replace(out_dir=staging / req.out_dir.relative_to(out))
+                for req in requests
+            ]
+            results = download_components(
+                cache, staged, retries=int(args.retries), jobs=args.jobs
+            )
+    else:
+        results = download_components(
+            cache,
+            requests,
+            test=args.test,
+            no_download=args.no_download,
+            retries=int(args.retries),
+            jobs=args.jobs,
+        )
+    if cache.max_size is not None:
+        cache.prune(cache.max_size)
+    if ExpandResult.Empty in results and args.empty_is_error:
         sys.exit(1)
 
 
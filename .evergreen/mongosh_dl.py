@@ -8,39 +8,173 @@ Use '--help' for more information.
 import argparse
 import json
 import logging
+import os
 import re
+import shutil
 import subprocess
 import sys
 from pathlib import Path
 
 LOGGER = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
 
 HERE = Path(__file__).absolute().parent
 sys.path.insert(0, str(HERE))
-from mongodl import LOGGER as DL_LOGGER
 from mongodl import (
+    FULL_JSON_TTL,
     Cache,
-    DownloadRetrier,
     ExpandResult,
-    _expand_archive,
+    RetryPolicy,
+    _fetch_component,
     default_cache_dir,
     infer_arch,
 )
+from mongodl import LOGGER as DL_LOGGER
+
+MONGOSH_JSON_URL = "https://downloads.mongodb.com/compass/mongosh.json"
 
 
-def _get_latest_version(cache: Cache, retries: int) -> str:
-    dl_url = "https://downloads.mongodb.com/compass/mongosh.json"
-    retrier = DownloadRetrier(retries)
+def _mongosh_versions(cache: Cache, retries: int) -> "list[str]":
+    """
+    Get the mongosh versions listed in mongosh.json, newest first.
+
+    The file is refreshed like full.json (see Cache.full_json_ttl), and
+    its downloads are indexed in the cache database whenever it changes.
+    """
+    policy = RetryPolicy(retries)
     while True:
         try:
-            cached = cache.download_file(dl_url).path
-            data = json.loads(cached.read_text())
-            return data["versions"][0]["version"]
+            dl = cache.download_file(
+                MONGOSH_JSON_URL, ttl=cache.full_json_ttl, default_ttl=FULL_JSON_TTL
+            )
+            break
         except Exception as e:
             LOGGER.exception(e)
-            if not retrier.retry():
+            if not policy.retry(e):
                 raise
+    db = cache.db
+    with db.transaction():
+        if db.memo_get("mongosh-json") != dl.sha256:
+            data = json.loads(dl.path.read_text())
+            db("DELETE FROM mdl_mongosh_downloads")
+            db.executemany(
+                r"""
+                INSERT INTO mdl_mongosh_downloads (position, version, url, sha256)
+                VALUES (:position, :version, :url, :sha256)
+                """,
+                (
+                    {
+                        "position": position,
+                        "version": ver["version"],
+                        "url": item["archive"]["url"],
+                        "sha256": item["archive"].get("sha256"),
+                    }
+                    for position, ver in enumerate(data["versions"])
+                    for item in ver.get("downloads", [])
+                    if "archive" in item
+                ),
+            )
+            db.memo_set("mongosh-json", dl.sha256)
+        rows = db(
+            "SELECT version FROM mdl_mongosh_downloads "
+            "GROUP BY version ORDER BY MIN(position)"
+        )
+    return [version for (version,) in rows]
+
+
+def _mongosh_sha256(cache: Cache, dl_url: str, retries: int) -> "str | None":
+    """
+    Get the expected SHA-256 of the mongosh archive at 'dl_url' from
+    mongosh.json, or None if it is not listed there.
+    """
+    try:
+        _mongosh_versions(cache, retries)
+    except Exception as e:
+        LOGGER.warning("Could not get mongosh.json, not verifying the download: %s", e)
+        return None
+    rows = cache.db(
+        "SELECT sha256 FROM mdl_mongosh_downloads WHERE url=:url AND sha256 NOT NULL",
+        url=dl_url,
+    )
+    if not rows:
+        LOGGER.warning("%s is not listed in mongosh.json, not verifying it", dl_url)
+        return None
+    return rows[0][0]
+
+
+def _resolve_version(cache: Cache, version: str, retries: int) -> str:
+    """
+    Resolve "latest", or a pattern like "2.3.x", to the newest matching mongosh
+    version. Other versions are returned as-is.
+    """
+    parts = version.split(".")
+    wildcards = ("x", "X", "*")
+    if version != "latest" and not any(p in wildcards for p in parts):
+        return version
+    versions = _mongosh_versions(cache, retries)
+    if version == "latest":
+        return versions[0]
+    for candidate in versions:
+        cparts = candidate.split(".")
+        if len(cparts) == len(parts) and all(
+            p in wildcards or p == c for p, c in zip(parts, cparts)
+        ):
+            return candidate
+    raise ValueError(f"No mongosh version matches {version!r}")
+
+
+def _openssl_suffix(cache: Cache) -> str:
+    """
+    Get the archive suffix for the OpenSSL version of this host. The result is
+    remembered in the cache database until the openssl binary changes.
+    """
+    exe = shutil.which("openssl")
+    key = None
+    if exe is not None:
+        stat = os.stat(exe)
+        key = f"openssl-suffix:{exe}:{stat.st_size}:{stat.st_mtime_ns}"
+        suffix = cache.db.memo_get(key)
+        if suffix is not None:
+            return suffix
+    openssl = subprocess.check_output(["openssl", "version"]).decode("utf-8")
+    suffix = ".tgz"
+    if "3." in openssl:
+        suffix = "-openssl3.tgz"
+    elif re.match("1.1.1[e-w] ", openssl):
+        suffix = "-openssl11.tgz"
+    if key is not None:
+        cache.db.memo_set(key, suffix)
+    return suffix
+
+
+def _download_url(
+    cache: Cache, version: str, target: str, arch: str, retries: int
+) -> str:
+    """
+    Get the download URL of a mongosh archive.
+    """
+    version = _resolve_version(cache, version, retries)
+    if arch == "x86_64":
+        arch = "x64"
+    elif arch == "aarch64":
+        arch = "arm64"
+    if target == "linux":
+        suffix = ".tgz"
+        if sys.platform == "linux" and arch in ["x64", "arm64"]:
+            suffix = _openssl_suffix(cache)
+    else:
+        suffix = ".zip"
+    return f"https://downloads.mongodb.com/compass/mongosh-{version}-{target}-{arch}{suffix}"
+
+
+def resolve_mongosh(
+    cache: Cache, version: str = "latest", retries: int = 0
+) -> "tuple[str, str | None]":
+    """
+    Get the download URL of mongosh for this host, as used by default on the
+    command line, and its expected SHA-256 if mongosh.json lists one.
+    """
+    dl_url = _download_url(cache, version, sys.platform, infer_arch(), retries)
+    return dl_url, _mongosh_sha256(cache, dl_url, retries)
 
 
 def _download(
@@ -56,23 +190,7 @@ def _download(
     retries: int,
 ) -> int:
     LOGGER.info(f"Download {version} mongosh for {target}-{arch}")
-    if version == "latest":
-        version = _get_latest_version(cache, retries)
-    if arch == "x86_64":
-        arch = "x64"
-    elif arch == "aarch64":
-        arch = "arm64"
-    if target == "linux":
-        suffix = ".tgz"
-        if sys.platform == "linux" and arch in ["x64", "arm64"]:
-            openssl = subprocess.check_output(["openssl", "version"])
-            if "3." in openssl.decode("utf-8"):
-                suffix = "-openssl3.tgz"
-            elif re.match("1.1.1[e-w] ", openssl.decode("utf-8")):
-                suffix = "-openssl11.tgz"
-    else:
-        suffix = ".zip"
-    dl_url = f"https://downloads.mongodb.com/compass/mongosh-{version}-{target}-{arch}{suffix}"
+    dl_url = _download_url(cache, version, target, arch, retries)
     # This must go to stdout to be consumed by the calling program.
     print(dl_url)
     LOGGER.info("Download url: %s", dl_url)
@@ -80,20 +198,15 @@ def _download(
     if no_download:
         return ExpandResult.Okay
 
-    retrier = DownloadRetrier(retries)
-    while True:
-        try:
-            cached = cache.download_file(dl_url).path
-            return _expand_archive(
-                cached, out_dir, pattern, strip_components, test=test
-            )
-        except Exception as e:
-            LOGGER.exception(e)
-            if not retrier.retry():
-                raise
+    # The checksum is verified as the file is downloaded, and stored with it
+    sha256 = _mongosh_sha256(cache, dl_url, retries)
+    return _fetch_component(
+        cache, dl_url, sha256, out_dir, pattern, strip_components, test, retries
+    )
 
 
 def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -136,7 +249,8 @@ def main(argv=None):
         "-V",
         default="latest",
         help='The product version to download. Use "latest" to download '
-        "the newest available stable version.",
+        'the newest available stable version, or a pattern like "2.3.x" to '
+        "download the newest matching version.",
     )
     dl_grp.add_argument(
         "--only",
@@ -20,6 +20,7 @@ import sys
 import time
 import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path, PureWindowsPath
 
@@ -445,14 +446,39 @@ def get_orchestration_data(opts):
     return data
 
 
-def clean_run(opts):
-    mdb_binaries = Path(opts.mongodb_binaries)
-    mdb_binaries_str = normalize_path(mdb_binaries)
-    shutil.rmtree(mdb_binaries_str, ignore_errors=True)
+def _rmtree_except(path, keep):
+    """Remove the directory 'path', except for the paths in 'keep' under it."""
+    if not any(path in k.parents for k in keep):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    for child in path.iterdir():
+        if child in keep:
+            continue
+        if child.is_dir() and not child.is_symlink():
+            _rmtree_except(child, keep)
+        else:
+            child.unlink(missing_ok=True)
+
+
+def clean_run(opts, keep_binaries=False):
+    if not keep_binaries:
+        mdb_binaries = Path(opts.mongodb_binaries)
+        mdb_binaries_str = normalize_path(mdb_binaries)
+        shutil.rmtree(mdb_binaries_str, ignore_errors=True)
 
     mongodb_dir = DRIVERS_TOOLS / "mongodb"
     if mongodb_dir.exists():
-        shutil.rmtree(normalize_path(mongodb_dir), ignore_errors=True)
+        keep = set()
+        if keep_binaries:
+            # The binaries are often in here (see the default --mongodb-binaries),
+            # along with the directories that Cache.install_tree() keeps next
+            # to them.
+            binaries = Path(normalize_path(opts.mongodb_binaries)).absolute()
+            keep = {
+                binaries.with_name(binaries.name + suffix)
+                for suffix in ("", ".prev", ".staging")
+            }
+        _rmtree_except(Path(normalize_path(mongodb_dir)).absolute(), keep)
 
     for path in [URI_TXT, MO_EXPANSION_SH, MO_EXPANSION_YML]:
         path.unlink(missing_ok=True)
@@ -463,12 +489,21 @@ def clean_run(opts):
 
 def run(opts):
     # Deferred import so we can run as a script without the cli installed.
-    from mongodl import main as mongodl
+    from mongodl import LOGGER as DL_LOGGER
+    from mongodl import (
+        Cache,
+        component_request,
+        download_components,
+        install_key,
+        set_trace_file,
+    )
     from mongosh_dl import main as mongosh_dl
+    from mongosh_dl import resolve_mongosh
 
     LOGGER.info("Running orchestration...")
     stop(opts)
-    clean_run(opts)
+    # The binaries are replaced as a whole below, or kept if they are current.
+    clean_run(opts, keep_binaries=True)
 
     # NOTE: in general, we need to normalize paths to account for cygwin/Windows.
     mdb_binaries = Path(opts.mongodb_binaries)
@@ -478,68 +513,130 @@ def run(opts):
     os.environ["PATH"] = f"{EVG_PATH}:{os.environ['PATH']}"
 
     dl_start = datetime.now()
+    # Record the download stages next to the other logs, unless asked otherwise.
+    if not os.environ.get("MONGODL_TRACE_FILE"):
+        set_trace_file(EVG_PATH / "mongodl-trace.log")
 
     version = opts.version
     cache_dir = DRIVERS_TOOLS / ".local/cache"
-    cache_dir_str = normalize_path(cache_dir)
-    default_args = f"--out {mdb_binaries_str} --cache-dir {cache_dir_str} --retries 5"
     if opts.quiet:
-        default_args += " -q"
+        DL_LOGGER.setLevel(logging.WARNING)
     elif opts.verbose:
-        default_args += " -v"
-
-    if opts.arch:
-        default_args += f" --arch={opts.arch}"
+        DL_LOGGER.setLevel(logging.DEBUG)
 
+    latest_build_branch = None
     if version in UNPUBLISHED_VERSIONS:
         LOGGER.warning(
             f"MongoDB {version} is not published in full.json; "
             f"using the latest v{version} nightly build instead."
         )
-        default_args += f" --latest-build-branch v{version}"
+        latest_build_branch = f"v{version}"
         version = "latest-build"
 
+    cache = Cache.open_in(Path(normalize_path(cache_dir)))
+
+    def request(component, version, strip_components, out_dir=None, pattern=None):
+        return component_request(
+            component,
+            version=version,
+            arch=opts.arch or None,
+            out_dir=out_dir or Path(mdb_binaries_str),
+            pattern=pattern,
+            strip_components=strip_components,
+            latest_build_branch=latest_build_branch,
+            cache=cache,
+        )
+
+    requests = []
     if not opts.local_atlas:
         # Download the archive.
-        args = f"{default_args} --version {version}"
-        args += " --strip-path-components 2 --component archive"
         if not opts.existing_binaries_dir:
             LOGGER.info(f"Downloading mongodb {version} to {mdb_binaries}...")
-            mongodl(shlex.split(args))
-            LOGGER.info(f"Downloading mongodb {version} to {mdb_binaries}... done.")
+            requests.append(request("archive", version, 2))
         else:
             LOGGER.info(
                 f"Using existing mongod binaries dir: {opts.existing_binaries_dir}"
             )
-            shutil.copytree(opts.existing_binaries_dir, mdb_binaries)
-
-        run_command(f"{mdb_binaries_str}/mongod --version")
 
     # Download legacy shell.
     if opts.install_legacy_shell:
-        args = f"{default_args} --version 5.0"
-        args += " --strip-path-components 2 --component shell"
-        LOGGER.INFO("Downloading legacy shell...")
-        mongodl(shlex.split(args))
-        LOGGER.INFO("Downloading legacy shell... done.")
+        LOGGER.info("Downloading legacy shell...")
+        requests.append(request("shell", "5.0", 2))
 
     # Download crypt shared.
+    crypt_requests = []
     if not opts.skip_crypt_shared:
-        # Get the download URL for crypt_shared.
         # We download crypt_shared to DRIVERS_TOOLS so that it is on a different
         # path location than the other binaries, which is required for
         # https://github.com/mongodb/specifications/blob/master/source/client-side-encryption/tests/README.md#via-bypassautoencryption
-        args = default_args + (
-            f" --version {version} --strip-path-components 1 --component crypt_shared"
-        )
+        # Only the library is extracted, and it is not part of the binaries
+        # tree below.
         LOGGER.info("Downloading crypt_shared...")
-        mongodl(shlex.split(args))
-        LOGGER.info("Downloading crypt_shared... done.")
-        crypt_shared_path = mdb_binaries / CRYPT_NAME_MAP[PLATFORM]
-        if crypt_shared_path.exists():
-            shutil.move(crypt_shared_path, DRIVERS_TOOLS)
-            crypt_shared_path = DRIVERS_TOOLS / crypt_shared_path.name
-        else:
+        crypt_requests.append(
+            request(
+                "crypt_shared",
+                version,
+                1,
+                out_dir=DRIVERS_TOOLS,
+                pattern=f"**/{CRYPT_NAME_MAP[PLATFORM]}",
+            )
+        )
+
+    # The binaries are installed into a staging directory, which then replaces
+    # the binaries directory. If that (or the one it replaced last time)
+    # already has the same components, nothing is downloaded.
+    cache.refresh_full_json()
+    mdb_dir = Path(mdb_binaries_str).absolute()
+
+    def describe():
+        key = install_key(cache, requests, mdb_dir)
+        mongosh_url, mongosh_sha256 = resolve_mongosh(cache, retries=5)
+        if key is None or mongosh_sha256 is None:
+            return None
+        mongosh = {
+            "url": mongosh_url,
+            "sha256": mongosh_sha256,
+            "out": ".",
+            "pattern": None,
+            "strip_components": 2,
+        }
+        return [*key, mongosh]
+
+    key = None if opts.existing_binaries_dir else describe
+    with cache.install_tree(mdb_dir, key) as staging, ThreadPoolExecutor(
+        max_workers=1
+    ) as pool:
+        staged = []
+        mongosh_future = None
+        if staging is not None:
+            if opts.existing_binaries_dir:
+                shutil.copytree(opts.existing_binaries_dir, staging, dirs_exist_ok=True)
+            staged = [
+                req._replace(out_dir=staging / req.out_dir.relative_to(mdb_dir))
+                for req in requests
+            ]
+            # Download mongosh alongside the server components.
+            args = (
+                f"--out {normalize_path(staging)} --strip-path-components 2 --retries 5"
+                f" --cache-dir {normalize_path(cache_dir)}"
+            )
+            if opts.verbose:
+                args += " -v"
+            elif opts.quiet:
+                args += " -q"
+            LOGGER.info("Downloading mongosh...")
+            mongosh_future = pool.submit(mongosh_dl, shlex.split(args))
+        download_components(cache, staged + crypt_requests, retries=5)
+        if mongosh_future is not None:
+            mongosh_future.result()
+    LOGGER.info("Downloading binaries... done.")
+
+    if not opts.local_atlas:
+        run_command(f"{mdb_binaries_str}/mongod --version")
+
+    if not opts.skip_crypt_shared:
+        crypt_shared_path = DRIVERS_TOOLS / CRYPT_NAME_MAP[PLATFORM]
+        if not crypt_shared_path.exists():
             raise RuntimeError(
                 f"Could not find expected crypt_shared_path: {crypt_shared_path}"
             )
@@ -547,16 +644,6 @@ def run(opts):
         MO_EXPANSION_YML.write_text(crypt_text)
         MO_EXPANSION_SH.write_text(crypt_text.replace(": ", "="))
 
-    # Download mongosh
-    args = f"--out {mdb_binaries_str} --strip-path-components 2 --retries 5"
-    if opts.verbose:
-        args += " -v"
-    elif opts.quiet:
-        args += " -q"
-    LOGGER.info("Downloading mongosh...")
-    mongosh_dl(shlex.split(args))
-    LOGGER.info("Downloading mongosh... done.")
-
     dl_end = datetime.now()
     mo_start = datetime.now()
 
@@ -23,14 +23,32 @@ bash install-cli.sh .
 
 if [ "${OS:-}" != "Windows_NT" ]; then
   ./mongodl --edition enterprise --version 7.0 --component archive-debug --no-download
+  VENV_PYTHON=venv/bin/python
 else
   DOWNLOAD_DIR=$(cygpath -m $DOWNLOAD_DIR)
+  VENV_PYTHON=venv/Scripts/python
 fi
 
+# Importing mongodl must stay cheap: the download and extraction modules are
+# only loaded when they are first used.
+$VENV_PYTHON -X importtime -c "import mongodl" 2>&1 | tail -n 1
+$VENV_PYTHON -c "import sys, mongodl; heavy = {'http.client', 'sqlite3', 'ssl', 'tarfile', 'zipfile'} & set(sys.modules); assert not heavy, heavy"
+
 ./mongodl --edition enterprise --version 7.0 --component archive --test --retries 5
+./mongodl --edition enterprise --version 7.0 --component archive,crypt_shared --test --retries 5 --jobs 2
+./mongodl --warm --edition enterprise --version 7.0,8.0 --component archive,crypt_shared --retries 5
+./mongodl --prune --max-cache-size 20G
+echo '[{"version": "7.0"}, {"version": "8.0", "component": "crypt_shared"}, {"version": "latest-build"}]' | ./mongodl --resolve-batch -
+# A malformed request is reported on its own, without failing the others.
+echo '[{"version": "7.0"}, 7.0, {"version": 8}]' | ./mongodl --resolve-batch - | grep -c '"error"' | grep -x 2
+./mongodl --export-bundle mongodl_bundle.tar --edition enterprise --version 7.0 --component archive --retries 5
+./mongodl --cache-dir mongodl_bundle_cache --import-bundle mongodl_bundle.tar
+./mongodl --cache-dir mongodl_bundle_cache --offline --edition enterprise --version 7.0 --component archive --test
+rm -rf mongodl_bundle.tar mongodl_bundle_cache
 ./mongodl --edition enterprise --version 7.0 --component cryptd --out ${DOWNLOAD_DIR} --strip-path-components 1 --retries 5
 ./mongosh-dl --no-download
 ./mongosh-dl --version 2.1.1 --no-download
+./mongosh-dl --version 2.3.x --no-download
 
 export PATH="${DOWNLOAD_DIR}/bin:$PATH"
 if [ "${OS:-}" != "Windows_NT" ]; then
@@ -44,6 +62,10 @@ fi
 rm -rf ${DOWNLOAD_DIR}
 bash install-cli.sh "$(pwd)/orchestration"
 ./mongodl --edition enterprise --version 7.0 --component archive --out ${DOWNLOAD_DIR} --strip-path-components 2 --retries 5
+# Replace the directory as a whole; the second run finds it up-to-date.
+./mongodl --edition enterprise --version 7.0 --component archive --out ${DOWNLOAD_DIR} --strip-path-components 2 --retries 5 --replace
+./mongodl --edition enterprise --version 7.0 --component archive --out ${DOWNLOAD_DIR} --strip-path-components 2 --retries 5 --replace
+rm -rf ${DOWNLOAD_DIR}.prev
 ./orchestration/drivers-orchestration run --existing-binaries-dir=${DOWNLOAD_DIR}
 ${DOWNLOAD_DIR}/mongod --version | grep v7.0
 ./orchestration/drivers-orchestration stop
@@ -52,6 +74,21 @@ ${DOWNLOAD_DIR}/mongod --version | grep v7.0
 ./orchestration/drivers-orchestration start --mongodb-binaries=${DOWNLOAD_DIR}
 ./orchestration/drivers-orchestration stop
 
+# Ensure a second run keeps the installed binaries instead of downloading them
+# again, both for a published version and for the default "latest" build.
+for version in 7.0 latest; do
+  ./orchestration/drivers-orchestration run --version $version
+  ./orchestration/drivers-orchestration stop
+  ./orchestration/drivers-orchestration run --version $version 2>&1 | tee orchestration-run.log
+  grep "is already up-to-date" orchestration-run.log
+  # Only crypt_shared, which is not part of the binaries tree, is revalidated.
+  if grep -E "Download url: .*/(mongodb|mongosh)-" orchestration-run.log; then
+    exit 1
+  fi
+  rm orchestration-run.log
+  ./orchestration/drivers-orchestration stop
+done
+
 if [ ${1:-} == "partial" ]; then
   popd
   make -C ${DRIVERS_TOOLS} test